@@ -36,5 +36,6 @@ pip3 install seaborn
 pip3 install torch torchvision torchaudio
 pip3 install SigMF==1.1.1
 pip3 install scikit-learn
+pip3 install numba
 
 echo "Installation complete. Please check the output files for any errors."
\ No newline at end of file
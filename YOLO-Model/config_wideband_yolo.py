@@ -63,6 +63,7 @@ BAND_MARGIN, SAMPLING_FREQUENCY = (
 )  # Band margin - determines the start frequency and end frequency from the calculated center frequency.
 BAND_MARGIN = BAND_MARGIN * 2  # Band margin - determines the start frequency and end frequency from the calculated center frequency.
 NUMTAPS = 101  # Number of taps for the filter - Higher number of taps means better filtering but slower processing.
+FFT_FILTER_MIN_SAMPLES = 4096  # Captures with at least this many samples are bandpass filtered by FFT (frequency-domain product) instead of direct convolution. Same result, cheaper for long captures.
 
 #####################
 # Model Parameters
@@ -70,6 +71,7 @@ NUMTAPS = 101  # Number of taps for the filter - Higher number of taps means bet
 S = 4  # Number of grid cells
 B = 4  # Anchors / Boxes per cell
 NUM_CLASSES = 7  # Number of classes
+SHARE_STAGE2_BACKBONE = False  # If True, the Stage-2 classifier reuses the first 4 Stage-1 residual blocks (shared weights) and is conditioned on the predicted frequency with a FiLM layer. The classifier keeps its own stride-1 stem. The shared blocks' BatchNorm running statistics then mix the wideband Stage-1 features with the downconverted per-box features, which fit the eval-mode normalisation to neither input exactly.
 
 #####################
 # Training Parameters
@@ -78,6 +80,20 @@ BATCH_SIZE = 64
 EPOCHS = 60
 LEARNING_RATE = 0.0005 # Initial learning rate
 FINAL_LR_MULTIPLE = 0.1 # Final learning rate multiple - the final learning rate will be this multiple of the initial learning rate.
+ACCUM_STEPS = 1  # Number of batches to accumulate gradients over before each optimizer step. Effective batch size is BATCH_SIZE * ACCUM_STEPS.
+
+#####################
+# Performance Parameters
+#####################
+USE_AMP = True  # If True, run the forward pass and loss under autocast (mixed precision) on CUDA devices.
+AMP_DTYPE = "bfloat16"  # Autocast precision, "bfloat16" or "float16". "float16" also enables gradient scaling.
+COMPILE_MODEL = True  # If True, compile the model with torch.compile (requires PyTorch 2.x). Set to False for eager debugging.
+COMPILE_MODE = "reduce-overhead"  # torch.compile mode: "default", "reduce-overhead" (CUDA graphs) or "max-autotune" (also autotunes the conv / matmul kernels, slower to compile).
+NUM_WORKERS = max(4, os.cpu_count() // 2)  # Number of DataLoader worker processes loading and preprocessing the captures, for the whole host (split between the processes on a node under torchrun).
+ACTIVATION_CHECKPOINTING = False  # If True, the residual blocks recompute their activations during the backward pass instead of storing them. Less memory (e.g. for a larger BATCH_SIZE) for roughly one extra forward pass of those blocks. Needs PyTorch >= 2.1 to keep the BatchNorm running statistics identical to training without it (older versions update them twice per step).
+GROUPED_STAGE2_STEM = False  # If True, the first classifier conv runs as one grouped Conv1d (groups=S*B, weights shared) over [batch, S*B*2, T] instead of over the [batch*S*B, 2, T] batch.
+CUDA_GRAPH_TEST = True  # If True, test inference on CUDA replays the forward pass from a captured CUDA graph when the model is not compiled (a model compiled with COMPILE_MODE="reduce-overhead" already uses CUDA graphs).
+QUANTIZE_TEST = False  # If True, test inference on CUDA runs under float16 autocast (no effect on CPU). The reported test metrics are then those of the reduced-precision model, compare them against a float32 (False) run.
 
 ########################
 # Loss Function Weights
@@ -95,12 +111,24 @@ def print_config_file():
     print("\tVAL_PRINT_SAMPLES:", VAL_PRINT_SAMPLES)
     print("\tBAND_MARGIN:", BAND_MARGIN)
     print("\tNUMTAPS:", NUMTAPS)
+    print("\tFFT_FILTER_MIN_SAMPLES:", FFT_FILTER_MIN_SAMPLES)
     print("\tS:", S)
     print("\tB:", B)
     print("\tNUM_CLASSES:", NUM_CLASSES)
+    print("\tSHARE_STAGE2_BACKBONE:", SHARE_STAGE2_BACKBONE)
     print("\tBATCH_SIZE:", BATCH_SIZE)
     print("\tEPOCHS:", EPOCHS)
     print("\tLEARNING_RATE:", LEARNING_RATE)
+    print("\tACCUM_STEPS:", ACCUM_STEPS)
+    print("\tUSE_AMP:", USE_AMP)
+    print("\tAMP_DTYPE:", AMP_DTYPE)
+    print("\tCOMPILE_MODEL:", COMPILE_MODEL)
+    print("\tCOMPILE_MODE:", COMPILE_MODE)
+    print("\tNUM_WORKERS:", NUM_WORKERS)
+    print("\tACTIVATION_CHECKPOINTING:", ACTIVATION_CHECKPOINTING)
+    print("\tGROUPED_STAGE2_STEM:", GROUPED_STAGE2_STEM)
+    print("\tCUDA_GRAPH_TEST:", CUDA_GRAPH_TEST)
+    print("\tQUANTIZE_TEST:", QUANTIZE_TEST)
     print("\tLAMBDA_COORD:", LAMBDA_COORD)
     print("\tLAMBDA_NOOBJ:", LAMBDA_NOOBJ)
     print("\tLAMBDA_CLASS:", LAMBDA_CLASS)
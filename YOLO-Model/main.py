@@ -8,12 +8,17 @@ import time
 import sys
 import os
 import random
+import contextlib
+import numpy as np
+from typing import List
 import torch.optim as optim
+import torch.distributed as dist
 import matplotlib.pyplot as plt
 import seaborn as sns
-from sklearn.metrics import confusion_matrix
 from tqdm import tqdm
 from torch.utils.data import DataLoader
+from torch.utils.data.distributed import DistributedSampler
+from torch.nn.parallel import DistributedDataParallel as DDP
 from dataset_wideband_yolo import WidebandYoloDataset
 from model_and_loss_wideband_yolo import WidebandYoloModel, WidebandYoloLoss
 from config_wideband_yolo import (
@@ -28,6 +33,14 @@ from config_wideband_yolo import (
     PRINT_CONFIG_FILE,
     print_config_file,
     MULTIPLE_JOBS_PER_TRAINING,
+    USE_AMP,
+    AMP_DTYPE,
+    COMPILE_MODEL,
+    COMPILE_MODE,
+    NUM_WORKERS,
+    ACCUM_STEPS,
+    QUANTIZE_TEST,
+    CUDA_GRAPH_TEST,
 )
 
 SAVE_MODEL_NAME = "yolo_model"
@@ -42,11 +55,192 @@ sys.path.append(working_directory)
 rng_seed = system_parameters["Random_Seed"]
 data_dir = system_parameters["Dataset_Directory"]
 
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-
 torch.manual_seed(rng_seed)
 random.seed(rng_seed)
 
+
+def setup_distributed():
+    """
+    Initialise the NCCL process group when launched with torchrun, e.g.
+        torchrun --nproc_per_node=N YOLO-Model/main.py
+    Falls back to a single process on the default device otherwise.
+    Returns the device this process should use.
+    """
+    if "LOCAL_RANK" not in os.environ:
+        return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    local_rank = int(os.environ["LOCAL_RANK"])
+    torch.cuda.set_device(local_rank)
+    dist.init_process_group(backend="nccl")
+    return torch.device(f"cuda:{local_rank}")
+
+
+def is_main_process():
+    return not dist.is_initialized() or dist.get_rank() == 0
+
+
+def unwrap_model(model):
+    # Return the underlying WidebandYoloModel (e.g. for saving / loading state dicts)
+    model = getattr(model, "_orig_mod", model)  # torch.compile wrapper
+    return model.module if isinstance(model, DDP) else model
+
+
+def compile_model(model):
+    # Static input shapes let Inductor specialise (and CUDA-graph) a single graph.
+    # The loss is called outside of the compiled module.
+    if COMPILE_MODEL and hasattr(torch, "compile"):
+        return torch.compile(model, mode=COMPILE_MODE)
+    return model
+
+
+def autocast(device, dtype=None, cache_enabled=True):
+    # Mixed precision context for the forward pass and loss (only enabled on CUDA).
+    # An explicit dtype overrides USE_AMP / AMP_DTYPE. cache_enabled=False disables the
+    # cache of cast weights, which CUDA graph capture requires.
+    enabled = (USE_AMP or dtype is not None) and device.type == "cuda"
+    return torch.autocast(
+        device_type=device.type,
+        dtype=dtype or getattr(torch, AMP_DTYPE),
+        enabled=enabled,
+        cache_enabled=cache_enabled,
+    )
+
+
+def all_reduce_sum(values, device):
+    # Sum a list of scalars (python numbers or 0-dim device tensors) across all
+    # processes and return them as python floats with a single host sync.
+    stats = torch.stack(
+        [torch.as_tensor(v, dtype=torch.float64, device=device) for v in values]
+    )
+    if dist.is_initialized():
+        dist.all_reduce(stats, op=dist.ReduceOp.SUM)
+    return stats.tolist()
+
+
+def allocate_metric_buffers(pred_shape, device):
+    # Scratch tensors for compute_metrics, allocated once per epoch and reused by
+    # every batch: [freq_err, obj_mask, pred_class_idx, true_class_idx].
+    S_dim, B_dim = pred_shape[0], pred_shape[1]
+    return [
+        torch.empty(BATCH_SIZE, S_dim, B_dim, dtype=torch.float32, device=device),
+        torch.empty(BATCH_SIZE, S_dim, B_dim, dtype=torch.bool, device=device),
+        torch.empty(BATCH_SIZE, S_dim, B_dim, dtype=torch.long, device=device),
+        torch.empty(BATCH_SIZE, S_dim, B_dim, dtype=torch.long, device=device),
+    ]
+
+
+@torch.jit.script
+def compute_metrics(
+    x_pred,
+    class_pred,
+    x_tgt,
+    conf_tgt,
+    class_tgt,
+    buffers: List[torch.Tensor],
+    per_sample: bool = False,
+):
+    # Object count, summed frequency error and correctly classified object count of a
+    # batch (or of each sample in it if per_sample). The masks are applied by
+    # multiplication (not boolean indexing) so nothing has to sync with the host, and
+    # the intermediates are written into the preallocated buffers (sliced to the
+    # batch size) instead of being allocated every batch. Inputs must not require grad.
+    bsize = conf_tgt.shape[0]
+    obj_mask = torch.gt(conf_tgt, 0, out=buffers[1][:bsize])
+    freq_err = torch.sub(x_pred, x_tgt, out=buffers[0][:bsize]).abs_().mul_(obj_mask)
+    pred_class_idx = torch.argmax(class_pred, dim=-1, out=buffers[2][:bsize])
+    true_class_idx = torch.argmax(class_tgt, dim=-1, out=buffers[3][:bsize])
+    correct_cls = pred_class_idx.eq_(true_class_idx).mul_(obj_mask)
+    if per_sample:
+        return (
+            obj_mask.sum(dim=[1, 2]),
+            freq_err.sum(dim=[1, 2]),
+            correct_cls.sum(dim=[1, 2]),
+        )
+    return obj_mask.sum(), freq_err.sum(), correct_cls.sum()
+
+
+class Prefetcher:
+    """
+    Wraps a DataLoader and yields its batches already on the device. On CUDA the
+    copy of batch N+1 is issued on a side stream while batch N is being processed,
+    so the host-to-device transfer overlaps with compute (needs pin_memory=True).
+    """
+
+    def __init__(self, loader, device):
+        self.loader = loader
+        self.device = device
+        self.stream = torch.cuda.Stream(device) if device.type == "cuda" else None
+
+    def __len__(self):
+        return len(self.loader)
+
+    def _to_device(self, batch):
+        return [t.to(self.device, non_blocking=True) for t in batch]
+
+    def _preload(self, loader_iter):
+        batch = next(loader_iter, None)
+        if batch is None:
+            return None
+        with torch.cuda.stream(self.stream):
+            return self._to_device(batch)
+
+    def __iter__(self):
+        loader_iter = iter(self.loader)
+        if self.stream is None:
+            for batch in loader_iter:
+                yield self._to_device(batch)
+            return
+
+        next_batch = self._preload(loader_iter)
+        while next_batch is not None:
+            current_stream = torch.cuda.current_stream(self.device)
+            current_stream.wait_stream(self.stream)
+            batch = next_batch
+            # The tensors were allocated on the side stream but are used on the current one.
+            for t in batch:
+                t.record_stream(current_stream)
+            next_batch = self._preload(loader_iter)
+            yield batch
+
+
+class CUDAGraphRunner:
+    """
+    Captures the inference forward pass for one fixed input shape in a CUDA graph and
+    replays it, so the many small conv kernels are launched as a single graph. Inputs
+    of any other shape (e.g. the last, smaller batch) run the model eagerly.
+    """
+
+    def __init__(self, model, time_data, freq_data, device, dtype=None):
+        self.model = model
+        self.static_time = time_data.clone()
+        self.static_freq = freq_data.clone()
+
+        # Warm up on a side stream (cuDNN algorithm selection, allocator) before capturing.
+        # Autocast's weight-cast cache is disabled for warmup and capture, so the graph
+        # does not keep using cast weight copies that are freed or reused outside its pool.
+        stream = torch.cuda.Stream(device)
+        stream.wait_stream(torch.cuda.current_stream(device))
+        with torch.cuda.stream(stream), autocast(device, dtype, cache_enabled=False):
+            for _ in range(3):
+                model(self.static_time, self.static_freq)
+        torch.cuda.current_stream(device).wait_stream(stream)
+
+        self.graph = torch.cuda.CUDAGraph()
+        with torch.cuda.graph(self.graph), autocast(device, dtype, cache_enabled=False):
+            self.static_out = model(self.static_time, self.static_freq)
+
+    def __call__(self, time_data, freq_data):
+        if (
+            time_data.shape != self.static_time.shape
+            or freq_data.shape != self.static_freq.shape
+        ):
+            return self.model(time_data, freq_data)
+        self.static_time.copy_(time_data)
+        self.static_freq.copy_(freq_data)
+        self.graph.replay()
+        # The next replay overwrites static_out.
+        return self.static_out.clone()
+
+
 def convert_to_readable(frequency, modclass, class_list):
     # Convert frequency to MHz and modclass to string
     
@@ -64,9 +258,31 @@ def convert_to_readable(frequency, modclass, class_list):
     modclass_str = class_list[modclass]
     return frequency_string, modclass_str
 
+
+def print_val_frames(val_frames):
+    # validate_model only captures up to VAL_PRINT_SAMPLES frames (in loader order),
+    # so this is an O(VAL_PRINT_SAMPLES) sample that just shuffles the print order.
+    to_print = random.sample(val_frames, min(VAL_PRINT_SAMPLES, len(val_frames)))
+    print(
+        f"\n  Some random frames from validation (only {VAL_PRINT_SAMPLES} shown):"
+    )
+    print(f"  Prediction format: (frequency, class, confidence)")
+    print(f"  GroundTruth format: (frequency, class)")
+    for idx, frame_dict in enumerate(to_print, 1):
+        pred_list = frame_dict["pred_list"]
+        gt_list = frame_dict["gt_list"]
+
+        print(f"    Frame {idx}:")
+        print(f"      Predicted => {pred_list}")
+        print(f"      GroundTruth=> {gt_list}")
+    print("")
+
+
 def main():
+    device = setup_distributed()
+
     # Print the configuration file
-    if PRINT_CONFIG_FILE:
+    if PRINT_CONFIG_FILE and is_main_process():
         print_config_file()
 
     # 1) Build dataset and loaders
@@ -79,9 +295,39 @@ def main():
     test_dataset = WidebandYoloDataset(
         os.path.join(data_dir, "testing"), transform=None
     )
-    train_loader = DataLoader(train_dataset, batch_size=BATCH_SIZE, shuffle=True)
-    val_loader = DataLoader(val_dataset, batch_size=BATCH_SIZE, shuffle=False)
-    test_loader = DataLoader(test_dataset, batch_size=BATCH_SIZE, shuffle=False)
+    # When running under torchrun each process trains / validates on its own shard.
+    train_sampler = None
+    val_sampler = None
+    if dist.is_initialized():
+        train_sampler = DistributedSampler(train_dataset, shuffle=True)
+        val_sampler = DistributedSampler(val_dataset, shuffle=False)
+    # NUM_WORKERS is for the whole host, so under torchrun it is split between the
+    # processes running on this node.
+    num_workers = NUM_WORKERS
+    if dist.is_initialized():
+        local_world_size = int(
+            os.environ.get("LOCAL_WORLD_SIZE", torch.cuda.device_count())
+        )
+        num_workers = max(1, NUM_WORKERS // local_world_size)
+    # Pinned host memory lets the non_blocking copies to the GPU overlap with compute,
+    # and persistent workers avoid re-forking the loader processes every epoch.
+    loader_kwargs = {
+        "batch_size": BATCH_SIZE,
+        "pin_memory": device.type == "cuda",
+        "num_workers": num_workers,
+        "persistent_workers": True,
+        "prefetch_factor": 4,
+    }
+    train_loader = DataLoader(
+        train_dataset,
+        shuffle=(train_sampler is None),
+        sampler=train_sampler,
+        **loader_kwargs,
+    )
+    val_loader = DataLoader(
+        val_dataset, shuffle=False, sampler=val_sampler, **loader_kwargs
+    )
+    test_loader = DataLoader(test_dataset, shuffle=False, **loader_kwargs)
 
     # 2) Create model & loss
     num_samples = train_dataset.get_num_samples()
@@ -94,25 +340,41 @@ def main():
         for i in range(EPOCHS):
             if os.path.exists(f"{SAVE_MODEL_NAME}_epoch_{i+1}.pth"):
                 # Load the model from the previous job
-                model = WidebandYoloModel(train_dataset.get_num_samples()).to(device)
-                model.load_state_dict(torch.load(f"{SAVE_MODEL_NAME}_epoch_{i+1}.pth"))
+                model.load_state_dict(
+                    torch.load(
+                        f"{SAVE_MODEL_NAME}_epoch_{i+1}.pth", map_location=device
+                    )
+                )
                 start_epoch = i + 1
-                print(f"Loaded model from epoch {i+1}")
+                if is_main_process():
+                    print(f"Loaded model from epoch {i+1}")
 
     if start_epoch == EPOCHS:
-        print("Model training complete. No more epochs to train.")
+        if is_main_process():
+            print("Model training complete. No more epochs to train.")
         return
 
+    if dist.is_initialized():
+        model = DDP(model, device_ids=[device.index])
+    model = compile_model(model)
+
+    # Loss scaling is only needed for float16, bfloat16 has the same range as float32.
+    scaler = torch.cuda.amp.GradScaler(
+        enabled=USE_AMP and AMP_DTYPE == "float16" and device.type == "cuda"
+    )
+
     # 3) Training loop
     for epoch in range(start_epoch, EPOCHS):
-        
+        if train_sampler is not None:
+            train_sampler.set_epoch(epoch)
+
         # Set the learning rate depending on the epoch. Starts at LEARNING_RATE and decreases by a factor of 10 by the last epoch.
         learn_rate = LEARNING_RATE * (FINAL_LR_MULTIPLE ** (epoch // EPOCHS))
         optimizer = optim.Adam(model.parameters(), lr=learn_rate)
         
         # Training
         model, avg_train_loss, train_mean_freq_err, train_cls_accuracy = train_model(
-            model, train_loader, device, optimizer, criterion, epoch
+            model, train_loader, device, optimizer, scaler, criterion, epoch
         )
 
         # Validation
@@ -120,6 +382,9 @@ def main():
             model, val_loader, device, criterion, epoch
         )
 
+        if not is_main_process():
+            continue
+
         # Print metrics for this epoch
         print(f"Epoch [{epoch+1}/{EPOCHS}]")
         print(
@@ -133,63 +398,85 @@ def main():
             f"  ClsAcc={val_cls_accuracy:.2f}%"
         )
 
-        # Print a random subset of "frames"
-        random.shuffle(val_frames)
-        to_print = val_frames[:VAL_PRINT_SAMPLES]  # up to VAL_PRINT_SAMPLES frames
-        print(
-            f"\n  Some random frames from validation (only {VAL_PRINT_SAMPLES} shown):"
-        )
-        print(f"  Prediction format: (frequency, class, confidence)")
-        print(f"  GroundTruth format: (frequency, class)")
-        for idx, frame_dict in enumerate(to_print, 1):
-            pred_list = frame_dict["pred_list"]
-            gt_list = frame_dict["gt_list"]
-
-            print(f"    Frame {idx}:")
-            print(f"      Predicted => {pred_list}")
-            print(f"      GroundTruth=> {gt_list}")
-        print("")
+        # Print the random subset of "frames" captured during validation
+        print_val_frames(val_frames)
 
         if MULTIPLE_JOBS_PER_TRAINING:
             # Save model every epoch
-            torch.save(model.state_dict(), f"{SAVE_MODEL_NAME}_epoch_{epoch+1}.pth")
+            torch.save(
+                unwrap_model(model).state_dict(),
+                f"{SAVE_MODEL_NAME}_epoch_{epoch+1}.pth",
+            )
             
             # Delete the previous model epoch to save space
             if epoch > 0:
                 os.remove(f"{SAVE_MODEL_NAME}_epoch_{epoch}.pth")
 
+    if not is_main_process():
+        dist.destroy_process_group()
+        return
+
     print("Training complete.")
 
-    # 4) Test the model
+    # 4) Test the model (single process, so no collectives are needed). Fusing replaces
+    # submodules, so the fused model is compiled anew rather than reusing the training
+    # compilation (whose guards would silently recompile it).
+    model = unwrap_model(model)
+    model.fuse_for_inference()
+    model = compile_model(model)
     test_model(model, test_loader, device)
 
+    if dist.is_initialized():
+        dist.destroy_process_group()
 
-def train_model(model, train_loader, device, optimizer, criterion, epoch):
-    model.train()
-    total_train_loss = 0.0
-
-    # For metrics:
-    train_obj_count = 0
-    train_correct_cls = 0
-    train_sum_freq_err = 0.0
 
-    for time_data, freq_data, label_tensor, _ in tqdm(
-        train_loader, desc=f"Training epoch {epoch+1}/{EPOCHS}"
+def train_model(model, train_loader, device, optimizer, scaler, criterion, epoch):
+    model.train()
+    # Fixed per-sample layout of the predictions: [S, B, 1 + 1 + NUM_CLASSES]
+    pred_shape = (unwrap_model(model).S, unwrap_model(model).B, 1 + 1 + NUM_CLASSES)
+    metric_buffers = allocate_metric_buffers(pred_shape, device)
+
+    # Loss and metrics are accumulated on the device and only synchronised at the end of the epoch.
+    total_train_loss = torch.zeros((), dtype=torch.float64, device=device)
+    train_obj_count = torch.zeros((), dtype=torch.float64, device=device)
+    train_correct_cls = torch.zeros((), dtype=torch.float64, device=device)
+    train_sum_freq_err = torch.zeros((), dtype=torch.float64, device=device)
+
+    # Gradients are accumulated over ACCUM_STEPS batches before each optimizer step.
+    ddp_model = getattr(model, "_orig_mod", model)
+    num_steps = len(train_loader)
+    optimizer.zero_grad(set_to_none=True)
+
+    for step, (time_data, freq_data, label_tensor, _) in enumerate(
+        tqdm(
+            Prefetcher(train_loader, device),
+            desc=f"Training epoch {epoch+1}/{EPOCHS}",
+            disable=not is_main_process(),
+        )
     ):
-        time_data = time_data.to(device)
-        freq_data = freq_data.to(device)
-        label_tensor = label_tensor.to(device)
-
-        optimizer.zero_grad()
-        pred = model(time_data, freq_data)
-        loss = criterion(pred, label_tensor)
-        loss.backward()
-        optimizer.step()
-        total_train_loss += loss.item()
-
-        # Additional training metrics
+        optimizer_step = (step + 1) % ACCUM_STEPS == 0 or step + 1 == num_steps
+        # DDP only has to all-reduce the gradients on the batch the optimizer steps on.
+        if isinstance(ddp_model, DDP) and not optimizer_step:
+            sync_context = ddp_model.no_sync()
+        else:
+            sync_context = contextlib.nullcontext()
+
+        with sync_context:
+            with autocast(device):
+                pred = model(time_data, freq_data)
+                loss = criterion(pred, label_tensor)
+            scaler.scale(loss / ACCUM_STEPS).backward()
+
+        if optimizer_step:
+            scaler.step(optimizer)
+            scaler.update()
+            optimizer.zero_grad(set_to_none=True)
+        total_train_loss += loss.detach()
+
+        # Additional training metrics (computed in float32)
+        pred = pred.detach().float()
         bsize = pred.shape[0]
-        pred_reshape = pred.view(bsize, pred.shape[1], -1, (1 + 1 + NUM_CLASSES))
+        pred_reshape = pred.reshape(bsize, *pred_shape)
         x_pred = pred_reshape[..., 0]
         class_pred = pred_reshape[..., 2:]
 
@@ -197,22 +484,32 @@ def train_model(model, train_loader, device, optimizer, criterion, epoch):
         conf_tgt = label_tensor[..., 1]
         class_tgt = label_tensor[..., 2:]
 
-        obj_mask = conf_tgt > 0
-        freq_err = torch.abs(x_pred - x_tgt)
-
-        pred_class_idx = torch.argmax(class_pred, dim=-1)
-        true_class_idx = torch.argmax(class_tgt, dim=-1)
-
-        batch_obj_count = obj_mask.sum().item()
-        batch_sum_freq_err = freq_err[obj_mask].sum().item()
-        correct_cls_mask = pred_class_idx == true_class_idx
-        batch_correct_cls = correct_cls_mask[obj_mask].sum().item()
+        batch_obj_count, batch_sum_freq_err, batch_correct_cls = compute_metrics(
+            x_pred, class_pred, x_tgt, conf_tgt, class_tgt, metric_buffers
+        )
 
         train_obj_count += batch_obj_count
         train_sum_freq_err += batch_sum_freq_err
         train_correct_cls += batch_correct_cls
 
-    avg_train_loss = total_train_loss / len(train_loader)
+    (
+        total_train_loss,
+        num_batches,
+        train_obj_count,
+        train_sum_freq_err,
+        train_correct_cls,
+    ) = all_reduce_sum(
+        [
+            total_train_loss,
+            len(train_loader),
+            train_obj_count,
+            train_sum_freq_err,
+            train_correct_cls,
+        ],
+        device,
+    )
+
+    avg_train_loss = total_train_loss / num_batches
     if train_obj_count > 0:
         train_mean_freq_err = train_sum_freq_err / train_obj_count
         train_cls_accuracy = 100.0 * (train_correct_cls / train_obj_count)
@@ -225,29 +522,43 @@ def train_model(model, train_loader, device, optimizer, criterion, epoch):
 
 def validate_model(model, val_loader, device, criterion, epoch):
     model.eval()
-    total_val_loss = 0.0
+    # Fixed per-sample layout of the predictions: [S, B, 1 + 1 + NUM_CLASSES]
+    pred_shape = (unwrap_model(model).S, unwrap_model(model).B, 1 + 1 + NUM_CLASSES)
+    metric_buffers = allocate_metric_buffers(pred_shape, device)
 
-    val_obj_count = 0
-    val_correct_cls = 0
-    val_sum_freq_err = 0.0
+    total_val_loss = torch.zeros((), dtype=torch.float64, device=device)
+    val_obj_count = torch.zeros((), dtype=torch.float64, device=device)
+    val_correct_cls = torch.zeros((), dtype=torch.float64, device=device)
+    val_sum_freq_err = torch.zeros((), dtype=torch.float64, device=device)
 
+    # Only the VAL_PRINT_SAMPLES frames that will be printed are extracted, so pick
+    # their positions in this process's iteration order up front.
     val_frames = []
     class_list = val_loader.dataset.class_list
+    num_val_samples = len(val_loader.sampler)
+    frames_to_capture = set(
+        random.sample(range(num_val_samples), min(VAL_PRINT_SAMPLES, num_val_samples))
+    )
+    sample_offset = 0
 
-    with torch.no_grad():
+    with torch.inference_mode():
         for time_data, freq_data, label_tensor, _ in tqdm(
-            val_loader, desc=f"Validation epoch {epoch+1}/{EPOCHS}"
+            val_loader,
+            desc=f"Validation epoch {epoch+1}/{EPOCHS}",
+            disable=not is_main_process(),
         ):
-            time_data = time_data.to(device)
-            freq_data = freq_data.to(device)
-            label_tensor = label_tensor.to(device)
+            time_data = time_data.to(device, non_blocking=True)
+            freq_data = freq_data.to(device, non_blocking=True)
+            label_tensor = label_tensor.to(device, non_blocking=True)
 
-            pred = model(time_data, freq_data)
-            loss = criterion(pred, label_tensor)
-            total_val_loss += loss.item()
+            with autocast(device):
+                pred = model(time_data, freq_data)
+                loss = criterion(pred, label_tensor)
+            total_val_loss += loss
 
+            pred = pred.float()
             bsize = pred.shape[0]
-            pred_reshape = pred.view(bsize, pred.shape[1], -1, (1 + 1 + NUM_CLASSES))
+            pred_reshape = pred.reshape(bsize, *pred_shape)
 
             x_pred = pred_reshape[..., 0]
             conf_pred = pred_reshape[..., 1]
@@ -257,59 +568,91 @@ def validate_model(model, val_loader, device, criterion, epoch):
             conf_tgt = label_tensor[..., 1]
             class_tgt = label_tensor[..., 2:]
 
-            obj_mask = conf_tgt > 0
-            freq_err = torch.abs(x_pred - x_tgt)
-
-            pred_class_idx = torch.argmax(class_pred, dim=-1)
-            true_class_idx = torch.argmax(class_tgt, dim=-1)
-
             # For metric sums
-            batch_obj_count = obj_mask.sum().item()
-            batch_sum_freq_err = freq_err[obj_mask].sum().item()
-            correct_cls_mask = pred_class_idx == true_class_idx
-            batch_correct_cls = correct_cls_mask[obj_mask].sum().item()
+            batch_obj_count, batch_sum_freq_err, batch_correct_cls = compute_metrics(
+                x_pred, class_pred, x_tgt, conf_tgt, class_tgt, metric_buffers
+            )
 
             val_obj_count += batch_obj_count
             val_sum_freq_err += batch_sum_freq_err
             val_correct_cls += batch_correct_cls
 
             # For printing the results in a "frame" manner:
-            # We group each sample in this batch separately.
-            for i in range(bsize):
-                pred_list = []
-                gt_list = []
-
-                for s_idx in range(pred_reshape.shape[1]):
-                    for b_idx in range(pred_reshape.shape[2]):
-                        x_p = x_pred[i, s_idx, b_idx].item()  # x_offset [0,1]
-                        x_p = (s_idx * SAMPLING_FREQUENCY / S) + x_p * (
-                            SAMPLING_FREQUENCY / S
-                        )  # raw frequency value.
-
-                        conf = conf_pred[i, s_idx, b_idx].item()
-                        cls_p = pred_class_idx[i, s_idx, b_idx].item()
-                        x_p, cls_p = convert_to_readable(x_p, cls_p, class_list)
-                        
-                        if conf > 0.2:
-                            pred_list.append((x_p, cls_p, conf))
-
-                        if conf_tgt[i, s_idx, b_idx] > 0:
-                            x_g = x_tgt[i, s_idx, b_idx].item()
-                            x_g = (s_idx * SAMPLING_FREQUENCY / S) + x_g * (
-                                SAMPLING_FREQUENCY / S
-                            )  # raw frequency value.
-                            
-                            cls_g = true_class_idx[i, s_idx, b_idx].item()
-                            x_g, cls_g = convert_to_readable(x_g, cls_g, class_list)
-                            gt_list.append((x_g, cls_g))
-
-                # sort by conf desc
-                pred_list.sort(key=lambda tup: tup[2], reverse=True)
+            capture = [
+                i for i in range(bsize) if sample_offset + i in frames_to_capture
+            ]
+            sample_offset += bsize
+            if not capture:
+                continue
+
+            # Keep only the highest-confidence boxes of the captured samples (topk
+            # returns them sorted by conf desc) and copy them to the host once.
+            num_boxes = pred_shape[0] * pred_shape[1]
+            conf_top, top_idx = torch.topk(
+                conf_pred[capture].reshape(len(capture), -1),
+                k=min(32, num_boxes),
+                dim=1,
+            )
+            x_top = x_pred[capture].reshape(len(capture), -1).gather(1, top_idx)
+            pred_class_top = (
+                class_pred[capture].argmax(dim=-1).reshape(len(capture), -1)
+            ).gather(1, top_idx)
+            conf_top_np = conf_top.cpu().numpy()
+            top_idx_np = top_idx.cpu().numpy()
+            pred_class_np = pred_class_top.cpu().numpy()
+            conf_tgt_np = conf_tgt[capture].cpu().numpy()
+            true_class_np = class_tgt[capture].argmax(dim=-1).cpu().numpy()
+            # raw frequency value = (cell index + x_offset) * cell width.
+            x_pred_raw = (top_idx_np // pred_shape[1] + x_top.cpu().numpy()) * (
+                SAMPLING_FREQUENCY / S
+            )
+            cell_idx = np.arange(pred_shape[0]).reshape(1, -1, 1)
+            x_tgt_raw = (cell_idx + x_tgt[capture].cpu().numpy()) * (
+                SAMPLING_FREQUENCY / S
+            )
+
+            # We group each captured sample separately.
+            for i in range(len(capture)):
+                pred_mask = conf_top_np[i] > 0.2
+                gt_mask = conf_tgt_np[i] > 0
+
+                pred_list = [
+                    (*convert_to_readable(x_p, cls_p, class_list), conf_p)
+                    for x_p, cls_p, conf_p in zip(
+                        x_pred_raw[i][pred_mask].tolist(),
+                        pred_class_np[i][pred_mask].tolist(),
+                        conf_top_np[i][pred_mask].tolist(),
+                    )
+                ]
+                gt_list = [
+                    convert_to_readable(x_g, cls_g, class_list)
+                    for x_g, cls_g in zip(
+                        x_tgt_raw[i][gt_mask].tolist(),
+                        true_class_np[i][gt_mask].tolist(),
+                    )
+                ]
 
                 frame_dict = {"pred_list": pred_list, "gt_list": gt_list}
                 val_frames.append(frame_dict)
 
-    avg_val_loss = total_val_loss / len(val_loader)
+    (
+        total_val_loss,
+        num_batches,
+        val_obj_count,
+        val_sum_freq_err,
+        val_correct_cls,
+    ) = all_reduce_sum(
+        [
+            total_val_loss,
+            len(val_loader),
+            val_obj_count,
+            val_sum_freq_err,
+            val_correct_cls,
+        ],
+        device,
+    )
+
+    avg_val_loss = total_val_loss / num_batches
     if val_obj_count > 0:
         val_mean_freq_err = val_sum_freq_err / val_obj_count
         val_cls_accuracy = 100.0 * (val_correct_cls / val_obj_count)
@@ -328,33 +671,45 @@ def test_model(model, test_loader, device):
     """
 
     model.eval()
-    total_obj_count = 0
-    total_correct_cls = 0
-    total_freq_err = 0.0
+    # Fixed per-sample layout of the predictions: [S, B, 1 + 1 + NUM_CLASSES]
+    pred_shape = (unwrap_model(model).S, unwrap_model(model).B, 1 + 1 + NUM_CLASSES)
+    metric_buffers = allocate_metric_buffers(pred_shape, device)
+    # float16 autocast rather than model.half(): the frequency offsets and the
+    # filter / downconversion phases are in Hz and would overflow in float16.
+    test_dtype = torch.float16 if QUANTIZE_TEST else None
+    # A compiled model ("reduce-overhead") already replays CUDA graphs.
+    use_cuda_graph = (
+        CUDA_GRAPH_TEST and device.type == "cuda" and not hasattr(model, "_orig_mod")
+    )
+    forward = model
 
-    # For confusion matrix
-    overall_true_classes = []
-    overall_pred_classes = []
+    # For confusion matrix - flattened [true class, predicted class] counts on the device
+    cm = torch.zeros(NUM_CLASSES * NUM_CLASSES, dtype=torch.long, device=device)
 
-    # For per-SNR stats
-    snr_obj_count = {}
-    snr_correct_cls = {}
-    snr_freq_err = {}
+    # For per-SNR stats - the per-sample sums stay on the device until the loop ends
+    # and are then grouped by SNR on the host (the SNRs never leave the host).
+    sample_snrs = []
+    sample_obj_count = []
+    sample_freq_err = []
+    sample_correct_cls = []
 
-    with torch.no_grad():
+    with torch.inference_mode():
         for time_data, freq_data, label_tensor, snr_tensor in tqdm(
             test_loader, desc=f"Testing on test set"
         ):
-            time_data = time_data.to(device)
-            freq_data = freq_data.to(device)
-            label_tensor = label_tensor.to(device)
-            pred = model(time_data, freq_data)  # shape [batch, S, B*(1+1+NUM_CLASSES)]
+            time_data = time_data.to(device, non_blocking=True)
+            freq_data = freq_data.to(device, non_blocking=True)
+            label_tensor = label_tensor.to(device, non_blocking=True)
+            if use_cuda_graph and forward is model:
+                forward = CUDAGraphRunner(model, time_data, freq_data, device, test_dtype)
+            with autocast(device, test_dtype):
+                pred = forward(time_data, freq_data)  # shape [batch, S, B*(1+1+NUM_CLASSES)]
+            pred = pred.float()
 
             # reshape
             bsize = pred.shape[0]
-            Sdim = pred.shape[1]  # should be S
             # interpret bounding boxes
-            pred_reshape = pred.view(bsize, Sdim, -1, (1 + 1 + NUM_CLASSES))
+            pred_reshape = pred.reshape(bsize, *pred_shape)
 
             x_pred = pred_reshape[..., 0]  # [bsize, S, B]
             class_pred = pred_reshape[..., 2:]
@@ -365,55 +720,61 @@ def test_model(model, test_loader, device):
 
             # object mask
             obj_mask = conf_tgt > 0
-            freq_err = torch.abs(x_pred - x_tgt)
 
             # predicted vs. true class => argmax
             pred_class_idx = torch.argmax(class_pred, dim=-1)  # [bsize, S, B]
             true_class_idx = torch.argmax(class_tgt, dim=-1)
 
-            # Now we accumulate stats for each bounding box with obj_mask=1
-            batch_obj_count = obj_mask.sum().item()
-            batch_sum_freq_err = freq_err[obj_mask].sum().item()
-            correct_cls_mask = pred_class_idx == true_class_idx
-            batch_correct_cls = correct_cls_mask[obj_mask].sum().item()
-
-            total_obj_count += batch_obj_count
-            total_freq_err += batch_sum_freq_err
-            total_correct_cls += batch_correct_cls
-
-            # For confusion matrix, we flatten the bounding boxes =>
-            # we only consider those bounding boxes with obj_mask=1
-            # then we gather pred_class_idx[obj_mask] and true_class_idx[obj_mask]
-            # convert to CPU
-            pred_class_flat = pred_class_idx[obj_mask].cpu().numpy()
-            true_class_flat = true_class_idx[obj_mask].cpu().numpy()
-            overall_true_classes.extend(true_class_flat.tolist())
-            overall_pred_classes.extend(pred_class_flat.tolist())
-
-            # Now do per-SNR
+            # Now we accumulate stats for each bounding box with obj_mask=1.
             # We have a single snr per "sample" => shape [bsize]
             # but we have multiple bounding boxes => we can count them all with that same SNR
-            snrs = snr_tensor.numpy()  # shape [bsize]
-            for i in range(bsize):
-                sample_snr = snrs[i]
-                # bounding boxes belonging to sample i => obj_mask[i]
-                # gather # of obj_mask=1 in that sample
-                sample_obj_mask = obj_mask[i]  # shape [S, B]
-                sample_obj_count = sample_obj_mask.sum().item()
-                if sample_obj_count > 0:
-                    sample_freq_err = freq_err[i][sample_obj_mask].sum().item()
-                    sample_correct_cls = (
-                        correct_cls_mask[i][sample_obj_mask].sum().item()
-                    )
-
-                    if sample_snr not in snr_obj_count:
-                        snr_obj_count[sample_snr] = 0
-                        snr_correct_cls[sample_snr] = 0
-                        snr_freq_err[sample_snr] = 0.0
+            obj_count, sum_freq_err, correct_cls = compute_metrics(
+                x_pred,
+                class_pred,
+                x_tgt,
+                conf_tgt,
+                class_tgt,
+                metric_buffers,
+                per_sample=True,
+            )
+            sample_snrs.append(snr_tensor)
+            sample_obj_count.append(obj_count)
+            sample_freq_err.append(sum_freq_err)
+            sample_correct_cls.append(correct_cls)
 
-                    snr_obj_count[sample_snr] += sample_obj_count
-                    snr_correct_cls[sample_snr] += sample_correct_cls
-                    snr_freq_err[sample_snr] += sample_freq_err
+            # For confusion matrix, we flatten the bounding boxes =>
+            # each box adds obj_mask (1 for boxes with an object, 0 otherwise)
+            # to its (true class, predicted class) cell
+            cm_idx = true_class_idx * NUM_CLASSES + pred_class_idx
+            cm.scatter_add_(0, cm_idx.flatten(), obj_mask.flatten().long())
+
+    # Now do per-SNR: copy the per-sample sums to the host once, map every sample to
+    # the index of its SNR value and sum the (obj count, freq error, correct cls)
+    # rows of each SNR with np.add.at. An empty test set has no SNRs (and zero counts).
+    if sample_snrs:
+        sample_stats = (
+            torch.stack(
+                [
+                    torch.cat(sample_obj_count).double(),
+                    torch.cat(sample_freq_err).double(),
+                    torch.cat(sample_correct_cls).double(),
+                ]
+            )
+            .cpu()
+            .numpy()
+        )
+        snr_values, snr_idx = np.unique(
+            torch.cat(sample_snrs).numpy(), return_inverse=True
+        )
+    else:
+        sample_stats = np.zeros((3, 0))
+        snr_values, snr_idx = np.zeros(0), np.zeros(0, dtype=np.intp)
+    snr_stats = np.zeros((3, len(snr_values)))
+    np.add.at(snr_stats, (slice(None), snr_idx), sample_stats)
+    total_obj_count, total_freq_err, total_correct_cls = snr_stats.sum(axis=1).tolist()
+    total_obj_count = int(total_obj_count)
+    snr_values = snr_values.tolist()
+    snr_obj_count, snr_freq_err, snr_correct_cls = snr_stats.tolist()
 
     # 1) Overall
     if total_obj_count > 0:
@@ -429,24 +790,19 @@ def test_model(model, test_loader, device):
     print(f"Mean Frequency Error (overall): {overall_freq_err:.4f}")
 
     # 2) Per-SNR
-    # sort the SNR keys
-    snr_keys_sorted = sorted(snr_obj_count.keys())
-    for snr_val in snr_keys_sorted:
-        if snr_obj_count[snr_val] > 0:
-            cls_acc_snr = 100.0 * snr_correct_cls[snr_val] / snr_obj_count[snr_val]
-            freq_err_snr = snr_freq_err[snr_val] / snr_obj_count[snr_val]
-        else:
-            cls_acc_snr = 0.0
-            freq_err_snr = 0.0
+    # np.unique returns the SNR values sorted; SNRs without any object are skipped
+    for i, snr_val in enumerate(snr_values):
+        if snr_obj_count[i] == 0:
+            continue
+        cls_acc_snr = 100.0 * snr_correct_cls[i] / snr_obj_count[i]
+        freq_err_snr = snr_freq_err[i] / snr_obj_count[i]
         print(
             f"SNR {snr_val:.1f}:  Accuracy={cls_acc_snr:.2f}%,  FreqErr={freq_err_snr:.4f}"
         )
 
     # If dataset has "class_list" or "label_to_idx" you can define:
     class_list = test_loader.dataset.class_list  # or however you track the modclass
-    cm = confusion_matrix(
-        overall_true_classes, overall_pred_classes, labels=range(len(class_list))
-    )
+    cm = cm.view(NUM_CLASSES, NUM_CLASSES).cpu().numpy()
     cm_percent = cm.astype(float)
     for i in range(cm.shape[0]):
         row_sum = cm[i].sum()
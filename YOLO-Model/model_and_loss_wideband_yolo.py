@@ -1,7 +1,11 @@
 import torch
 import math
+import contextlib
+import inspect
 import torch.nn as nn
 import torch.nn.functional as F
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+from torch.utils.checkpoint import checkpoint
 from config_wideband_yolo import (
     S,
     B,
@@ -11,7 +15,11 @@ from config_wideband_yolo import (
     LAMBDA_CLASS,
     BAND_MARGIN,
     NUMTAPS,
+    FFT_FILTER_MIN_SAMPLES,
     SAMPLING_FREQUENCY,
+    GROUPED_STAGE2_STEM,
+    ACTIVATION_CHECKPOINTING,
+    SHARE_STAGE2_BACKBONE,
     get_anchors,
 )
 
@@ -19,6 +27,7 @@ from config_wideband_yolo import (
 ###############################################################################
 # Helper to build a lowpass filter kernel in PyTorch
 ###############################################################################
+@torch.no_grad()
 def build_lowpass_filter(cutoff_hz, fs, num_taps, window="hamming"):
     M = num_taps
     n = torch.arange(M, dtype=torch.float32)
@@ -53,113 +62,157 @@ def build_lowpass_filter(cutoff_hz, fs, num_taps, window="hamming"):
     return h
 
 
-def conv1d_batch(x, weight, pad_left, pad_right):
-    x_padded = F.pad(x, (pad_left, pad_right))
-    x_unf = x_padded.unfold(dimension=2, size=weight.shape[-1], step=1)
-    weight = weight.unsqueeze(2)
-    y = (x_unf * weight).sum(dim=-1)
-    return y
+###############################################################################
+# Activation checkpointing that leaves the BatchNorm running statistics alone
+###############################################################################
+@contextlib.contextmanager
+def preserve_batchnorm_buffers(module):
+    """
+    Restore the running statistics (and batch counters) of every BatchNorm inside
+    module on exit, so a forward pass run inside the context does not update them.
+    """
+    bns = [
+        m
+        for m in module.modules()
+        if isinstance(m, nn.modules.batchnorm._BatchNorm) and m.track_running_stats
+    ]
+    saved = [
+        (m.running_mean.clone(), m.running_var.clone(), m.num_batches_tracked.clone())
+        for m in bns
+    ]
+    try:
+        yield
+    finally:
+        with torch.no_grad():
+            for m, (mean, var, count) in zip(bns, saved):
+                m.running_mean.copy_(mean)
+                m.running_var.copy_(var)
+                m.num_batches_tracked.copy_(count)
+
+
+# checkpoint only takes a recomputation context (context_fn) from PyTorch 2.1.
+CHECKPOINT_HAS_CONTEXT_FN = "context_fn" in inspect.signature(checkpoint).parameters
+
+
+def _is_compiling():
+    compiler = getattr(torch, "compiler", None)
+    return hasattr(compiler, "is_compiling") and compiler.is_compiling()
+
+
+def checkpoint_block(block, x):
+    """
+    Run block on x with its activations recomputed during the backward pass. The
+    recomputation runs the BatchNorm layers in train mode again, so their running
+    statistics are restored afterwards: each training step updates them exactly once,
+    as without checkpointing. Before PyTorch 2.1 they cannot be restored and are
+    updated twice per step.
+    """
+    if not CHECKPOINT_HAS_CONTEXT_FN or _is_compiling():
+        # Under torch.compile the recomputation is part of the compiled backward graph,
+        # which does not repeat the buffer updates of the forward pass.
+        return checkpoint(block, x, use_reentrant=False)
+    return checkpoint(
+        block,
+        x,
+        use_reentrant=False,
+        context_fn=lambda: (contextlib.nullcontext(), preserve_batchnorm_buffers(block)),
+    )
 
 
 ###############################################################################
-# Residual block (used in Stage-1)
+# Residual block (used in Stage-1 and in the Stage-2 classifier)
 ###############################################################################
 class ResidualBlock(nn.Module):
     def __init__(self, in_ch, out_ch):
         super().__init__()
+        # The two kernel-1 branches (32 channels each) are one 64-channel convolution.
         self.branch1 = nn.Sequential(
-            nn.Conv1d(in_ch, 32, kernel_size=1, stride=2),
-            nn.BatchNorm1d(32),
-            nn.ReLU(),
+            nn.Conv1d(in_ch, 64, kernel_size=1, stride=2),
+            nn.BatchNorm1d(64),
+            nn.ReLU(inplace=True),
         )
         self.branch2 = nn.Sequential(
             nn.Conv1d(in_ch, 32, kernel_size=3, stride=2, padding=1),
             nn.BatchNorm1d(32),
-            nn.ReLU(),
-        )
-        self.branch3 = nn.Sequential(
-            nn.Conv1d(in_ch, 32, kernel_size=1, stride=2),
-            nn.BatchNorm1d(32),
-            nn.ReLU(),
+            nn.ReLU(inplace=True),
         )
         self.residual = nn.Sequential(
             nn.Conv1d(in_ch, out_ch, kernel_size=1, stride=2),
             nn.BatchNorm1d(out_ch),
         )
-        self.out_ch = out_ch
 
     def forward(self, x):
         res = self.residual(x)
         b1 = self.branch1(x)
         b2 = self.branch2(x)
-        b3 = self.branch3(x)
-        concat = torch.cat([b1, b2, b3], dim=1)
-        out = F.relu(concat + res)
-        return out
+        concat = torch.cat([b1, b2], dim=1)
+        # concat is a fresh tensor, add the residual and apply the ReLU in place
+        return F.relu_(concat.add_(res))
 
 
 ###############################################################################
 # New WidebandClassifier (Stage-2: Confidence and Classification)
 ###############################################################################
 class WidebandClassifier(nn.Module):
-    def __init__(self, num_out):
+    def __init__(self, num_out, shared_blocks=None):
         """
         num_out: output dimension, here (1 + NUM_CLASSES) where the first element is confidence.
+        shared_blocks: optional residual blocks (block2_layers) to use instead of building
+        new ones. The pooled features are then FiLM-conditioned on the normalised
+        frequency offset of each box.
         """
         super(WidebandClassifier, self).__init__()
         # Conv Block 1 (as in narrowband model)
         self.conv_block1 = nn.Sequential(
             nn.Conv1d(2, 32, kernel_size=8, stride=1),
             nn.BatchNorm1d(32),
-            nn.ReLU(),
+            nn.ReLU(inplace=True),
             nn.MaxPool1d(kernel_size=2, stride=2),
         )
-        # Block 2 repeated 4 times
-        self.block2_layers = nn.ModuleList(
-            [self._create_block2(32 if i == 0 else 96, 96) for i in range(4)]
-        )
-        # Global Average Pooling
-        self.global_avg_pool = nn.AdaptiveAvgPool1d(1)
+        if shared_blocks is not None:
+            self.block2_layers = shared_blocks
+            # Per-channel scale and shift of the pooled features.
+            self.film = nn.Linear(1, 2 * 96)
+        else:
+            # Block 2 (a residual block) repeated 4 times
+            self.block2_layers = nn.ModuleList(
+                [ResidualBlock(32 if i == 0 else 96, 96) for i in range(4)]
+            )
+            self.film = None
         # Fully Connected Layer producing (1 + NUM_CLASSES) outputs.
         self.fc = nn.Linear(96, num_out)
 
-    def _create_block2(self, in_channels, out_channels):
-        return nn.ModuleDict(
-            {
-                "branch1": nn.Sequential(
-                    nn.Conv1d(in_channels, 32, kernel_size=1, stride=2),
-                    nn.BatchNorm1d(32),
-                    nn.ReLU(),
-                ),
-                "branch2": nn.Sequential(
-                    nn.Conv1d(in_channels, 32, kernel_size=3, stride=2, padding=1),
-                    nn.BatchNorm1d(32),
-                    nn.ReLU(),
-                ),
-                "branch3": nn.Sequential(
-                    nn.Conv1d(in_channels, 32, kernel_size=1, stride=2),
-                    nn.BatchNorm1d(32),
-                    nn.ReLU(),
-                ),
-                "residual": nn.Sequential(
-                    nn.Conv1d(in_channels, out_channels, kernel_size=1, stride=2),
-                    nn.BatchNorm1d(out_channels),
-                ),
-            }
+    def _stem_conv(self, x):
+        conv = self.conv_block1[0]
+        if not GROUPED_STAGE2_STEM:
+            return conv(x)
+        # The N = bsz*S*B boxes are stacked along the channel axis and convolved in
+        # S*B groups, all using the same (repeated) kernel: one larger cuDNN call.
+        N, C, T = x.shape
+        groups = S * B
+        y = F.conv1d(
+            x.reshape(N // groups, groups * C, T),
+            conv.weight.repeat(groups, 1, 1),
+            conv.bias.repeat(groups),
+            stride=conv.stride,
+            groups=groups,
         )
+        return y.reshape(N, conv.out_channels, -1)
 
-    def forward(self, x):
+    def forward(self, x, freq=None):
         # x: [N, 2, T] where T is the length of the downconverted signal.
-        x = self.conv_block1(x)
+        # freq: [N, 1] normalised frequency offset of each box (only used with FiLM).
+        x = self._stem_conv(x)
+        x = self.conv_block1[1:](x)
         for block in self.block2_layers:
-            residual = block["residual"](x)
-            branch1 = block["branch1"](x)
-            branch2 = block["branch2"](x)
-            branch3 = block["branch3"](x)
-            concatenated = torch.cat([branch1, branch2, branch3], dim=1)
-            x = F.relu(concatenated + residual)
-        x = self.global_avg_pool(x)
-        x = x.view(x.size(0), -1)
+            if ACTIVATION_CHECKPOINTING and self.training:
+                x = checkpoint_block(block, x)
+            else:
+                x = block(x)
+        x = x.mean(dim=-1)  # Global Average Pooling
+        if self.film is not None:
+            gamma, beta = self.film(freq).chunk(2, dim=-1)
+            x = x * (1 + gamma) + beta
         x = self.fc(x)
         return x
 
@@ -171,6 +224,8 @@ class WidebandYoloModel(nn.Module):
     def __init__(self, num_samples):
         super().__init__()
         self.num_samples = num_samples
+        self.S = S  # grid cells
+        self.B = B  # boxes per cell
 
         # -----------------------
         # Stage-1: Frequency Prediction
@@ -179,7 +234,7 @@ class WidebandYoloModel(nn.Module):
         self.first_conv = nn.Sequential(
             nn.Conv1d(2, 32, kernel_size=8, stride=2),
             nn.BatchNorm1d(32),
-            nn.ReLU(),
+            nn.ReLU(inplace=True),
             nn.MaxPool1d(kernel_size=2, stride=2),
         )
         self.stage1_blocks = nn.Sequential(
@@ -194,19 +249,21 @@ class WidebandYoloModel(nn.Module):
             ResidualBlock(96, 96),
             ResidualBlock(96, 96),
         )
-        self.pool_1 = nn.AdaptiveAvgPool1d(1)
 
         # Time–Frequency branch.
         self.tf_branch = nn.Sequential(
             nn.Conv2d(1, 8, kernel_size=(3, 1), stride=1, padding=(1, 0)),
             nn.BatchNorm2d(8),
-            nn.ReLU(),
+            nn.ReLU(inplace=True),
             nn.MaxPool2d((2, 1)),
             nn.Conv2d(8, 16, kernel_size=(3, 1), stride=1, padding=(1, 0)),
             nn.BatchNorm2d(16),
-            nn.ReLU(),
+            nn.ReLU(inplace=True),
             nn.AdaptiveAvgPool2d((4, 1)),
         )
+        # The 2D convolutions run in channels_last (NHWC), their fast path on tensor cores.
+        # The 1D convolutions have no channels_last format and stay as they are.
+        self.tf_branch.to(memory_format=torch.channels_last)
         self.tf_fc = nn.Linear(16 * 4, 32)
 
         # -----------------------
@@ -220,14 +277,43 @@ class WidebandYoloModel(nn.Module):
             initial_anchor_values.unsqueeze(0).repeat(S, 1)
         )  # shape: [S, B]
         self.freq_predictor = nn.Linear(128, S * B)
+        # Grid cell index of every box, used to turn the offsets into raw frequencies.
+        # Not persistent so checkpoints saved without it still load.
+        self.register_buffer(
+            "_cell_idx",
+            torch.arange(S, dtype=torch.float32).view(1, S, 1),
+            persistent=False,
+        )
+        # Sample times of the downconversion, [1, num_samples].
+        self.register_buffer(
+            "_t",
+            torch.arange(num_samples, dtype=torch.float32).div_(SAMPLING_FREQUENCY)[None],
+            persistent=False,
+        )
+        # The fixed lowpass prototype of the per-box bandpass filters, [1, NUMTAPS], and
+        # the tap positions relative to the filter centre, [NUMTAPS].
+        self.register_buffer(
+            "_h_lp",
+            build_lowpass_filter(
+                cutoff_hz=BAND_MARGIN,
+                fs=SAMPLING_FREQUENCY,
+                num_taps=NUMTAPS,
+                window="kaiser",
+            )[None],
+            persistent=False,
+        )
+        self.register_buffer(
+            "_tap_offsets",
+            torch.arange(NUMTAPS, dtype=torch.float32) - (NUMTAPS - 1) / 2.0,
+            persistent=False,
+        )
 
         # Refinement branch.
         self.refinement_branch = nn.Sequential(
             nn.Conv1d(2, 16, kernel_size=5, stride=2, padding=2),
-            nn.ReLU(),
+            nn.ReLU(inplace=True),
             nn.Conv1d(16, 32, kernel_size=5, stride=2, padding=2),
-            nn.ReLU(),
-            nn.AdaptiveAvgPool1d(1),
+            nn.ReLU(inplace=True),
         )
         self.refine_fc = nn.Linear(32, S * B)
 
@@ -235,7 +321,18 @@ class WidebandYoloModel(nn.Module):
         # Stage-2: Confidence and Classification using the new classifier.
         # -----------------------
         # This classifier follows the narrowband architecture (adapted for 1+NUM_CLASSES outputs)
-        self.classifier = WidebandClassifier(num_out=1 + NUM_CLASSES)
+        if SHARE_STAGE2_BACKBONE:
+            # Reuse the first 4 Stage-1 residual blocks (the same layout as the classifier's
+            # own) so both stages train one set of block weights. The classifier keeps its
+            # own stride-1 stem: the Stage-1 stem has stride 2 and would halve the time
+            # resolution of the downconverted signals. The BatchNorm running statistics of
+            # the shared blocks are estimated over both stages' inputs.
+            shared_blocks = nn.ModuleList(self.stage1_blocks[:4])
+        else:
+            shared_blocks = None
+        self.classifier = WidebandClassifier(
+            num_out=1 + NUM_CLASSES, shared_blocks=shared_blocks
+        )
 
     def forward(self, x_time, x_freq):
         bsz = x_time.size(0)
@@ -243,13 +340,18 @@ class WidebandYoloModel(nn.Module):
         # Stage-1: Coarse Frequency Prediction
         # -----------------------
         h1 = self.first_conv(x_time)
-        h1 = self.stage1_blocks(h1)
-        h1 = self.pool_1(h1).squeeze(-1)  # [bsz, 96]
+        if ACTIVATION_CHECKPOINTING and self.training:
+            for block in self.stage1_blocks:
+                h1 = checkpoint_block(block, h1)
+        else:
+            h1 = self.stage1_blocks(h1)
+        h1 = h1.mean(dim=-1)  # global average pool, [bsz, 96]
 
         spec = torch.sqrt(x_freq[:, 0, :] ** 2 + x_freq[:, 1, :] ** 2)
         spec = spec.unsqueeze(1).unsqueeze(-1)  # [bsz, 1, N_rfft, 1]
+        spec = spec.contiguous(memory_format=torch.channels_last)
         tf_features = self.tf_branch(spec)
-        tf_features = tf_features.view(bsz, -1)  # [bsz, 64]
+        tf_features = tf_features.reshape(bsz, -1)  # [bsz, 64]
         tf_features = self.tf_fc(tf_features)  # [bsz, 32]
 
         combined_features = torch.cat([h1, tf_features], dim=1)  # [bsz, 128]
@@ -257,97 +359,121 @@ class WidebandYoloModel(nn.Module):
         # Predict delta for frequency offset.
         raw_delta = self.freq_predictor(combined_features)  # shape: [bsz, S*B]
         raw_delta = raw_delta.view(bsz, S, B)
-        delta_coarse = 0.5 * torch.tanh(raw_delta)
+        # The linear outputs are fresh tensors only used here, so tanh can run in place.
+        delta_coarse = 0.5 * torch.tanh_(raw_delta)
         # Use the learnable anchors (expanded over the batch) plus the delta.
         coarse_freq_pred = self.anchors.unsqueeze(0) + delta_coarse  # [bsz, S, B]
 
         refine_feat = self.refinement_branch(x_time)
-        refine_feat = refine_feat.squeeze(-1)
+        refine_feat = refine_feat.mean(dim=-1)  # [bsz, 32]
         refine_delta = self.refine_fc(refine_feat)
-        refine_delta = 0.1 * torch.tanh(refine_delta)
+        refine_delta = 0.1 * torch.tanh_(refine_delta)
         refine_delta = refine_delta.view(bsz, S, B)
 
         # Final predicted normalized offset.
         freq_pred = coarse_freq_pred + refine_delta # [bsz, S, B]
 
-        cell_indices = torch.arange(
-            S, device=freq_pred.device, dtype=freq_pred.dtype
-        ).view(1, S, 1)
-        freq_pred_raw = (cell_indices + freq_pred) * (SAMPLING_FREQUENCY / 2) / S
-        freq_pred_flat = freq_pred_raw.view(bsz * S * B)
+        freq_pred_raw = (self._cell_idx + freq_pred) * (SAMPLING_FREQUENCY / 2) / S
+        freq_pred_flat = freq_pred_raw.reshape(-1)  # [bsz*S*B]
 
         # -----------------------
         # Stage-2: Downconversion and Classification
         # -----------------------
-        x_rep = x_time.unsqueeze(1).unsqueeze(1).expand(-1, S, B, -1, -1)
-        x_rep = x_rep.contiguous().view(bsz * S * B, 2, self.num_samples)
-
-        x_filt = self._filter_raw(x_rep, freq_pred_flat)
-        x_base = self._downconvert_multiple(x_filt, freq_pred_flat)
-
-        out_conf_class = self.classifier(x_base)  # [bsz*S*B, 1+NUM_CLASSES]
+        # The bandpass taps and downconversion phases are computed from frequencies in Hz,
+        # so this part always runs in float32. Autocast applies again from the classifier
+        # on, which casts its conv inputs to the lower precision.
+        with torch.autocast(device_type=x_time.device.type, enabled=False):
+            freq_pred_flat = freq_pred_flat.float()
+            x_filt = self._filter_raw(x_time.float(), freq_pred_flat)  # [bsz*S*B, 2, T]
+            x_base = self._downconvert_multiple(x_filt, freq_pred_flat)
+
+        out_conf_class = self.classifier(
+            x_base, freq_pred.reshape(-1, 1)
+        )  # [bsz*S*B, 1+NUM_CLASSES]
         out_conf_class = out_conf_class.view(bsz, S, B, 1 + NUM_CLASSES)
 
-        final_out = torch.zeros(
-            bsz,
-            S,
-            B,
-            (1 + 1 + NUM_CLASSES),
-            dtype=out_conf_class.dtype,
-            device=out_conf_class.device,
+        # Use the dtype of freq_pred (float32 under autocast) so the frequency
+        # offsets are not rounded to the lower precision of the classifier output.
+        final_out = torch.cat(
+            [
+                freq_pred.unsqueeze(-1),  # normalized frequency offset
+                out_conf_class.to(freq_pred.dtype),
+            ],
+            dim=-1,
         )
-        final_out[..., 0] = freq_pred  # normalized frequency offset
-        final_out[..., 1:] = out_conf_class
         final_out = final_out.view(bsz, S, B * (1 + 1 + NUM_CLASSES))
         return final_out
 
-    def _filter_raw(self, x_flat, freq_flat):
-        N, _, T = x_flat.shape
+    def fuse_for_inference(self):
+        """
+        Fold every BatchNorm that directly follows a convolution into that convolution's
+        weight and bias, replacing the BatchNorm with nn.Identity. Puts the model in eval
+        mode; only call this once training is finished, the resulting state dict no longer
+        matches the training checkpoints.
+        """
+        self.eval()
+        for module in list(self.modules()):
+            if not isinstance(module, nn.Sequential):
+                continue
+            for i in range(len(module) - 1):
+                conv, bn = module[i], module[i + 1]
+                if isinstance(conv, (nn.Conv1d, nn.Conv2d)) and isinstance(
+                    bn, (nn.BatchNorm1d, nn.BatchNorm2d)
+                ):
+                    module[i] = fuse_conv_bn_eval(conv, bn)
+                    module[i + 1] = nn.Identity()
+        return self
+
+    def _filter_raw(self, x, freq_flat):
+        # x: [bsz, 2, T], freq_flat: [bsz*S*B]. Each I/Q channel of a sample is filtered
+        # by all S*B bandpass filters of that sample in one grouped convolution
+        # (groups = bsz*2), so the input is never replicated S*B times.
+        bsz, _, T = x.shape
+        N = freq_flat.shape[0]
         M = NUMTAPS
-        alpha = (M - 1) / 2.0
-        n = torch.arange(M, device=x_flat.device, dtype=x_flat.dtype) - alpha
-        h_lp = build_lowpass_filter(
-            cutoff_hz=BAND_MARGIN,
-            fs=SAMPLING_FREQUENCY,
-            num_taps=NUMTAPS,
-            window="kaiser",
-        )
-        h_lp = h_lp.to(x_flat.device)
-        h_lp = h_lp.unsqueeze(0)
         f0 = freq_flat.view(N, 1)
-        cos_factor = torch.cos(2 * math.pi * f0 * n / SAMPLING_FREQUENCY)
-        h_bp_all = h_lp * cos_factor
-        h_bp_all_expanded = h_bp_all.unsqueeze(1).repeat(1, 2, 1)
-        x_reshaped = x_flat.reshape(N * 2, 1, T)
-        weight = h_bp_all_expanded.reshape(N * 2, 1, M)
+        cos_factor = torch.cos(2 * math.pi * f0 * self._tap_offsets / SAMPLING_FREQUENCY)
+        h_bp_all = self._h_lp * cos_factor  # [bsz*S*B, M]
         pad_left = M // 2
         pad_right = M - 1 - pad_left
-        y = conv1d_batch(x_reshaped, weight, pad_left, pad_right)
-        y = y.reshape(N, 2, T)
-        return y
+        if T >= FFT_FILTER_MIN_SAMPLES:
+            return self._filter_fft(x, h_bp_all, pad_right)
+        # Output channel (b, c, k) of the grouped conv applies filter k of sample b to channel c.
+        weight = h_bp_all.view(bsz, 1, N // bsz, M).expand(-1, 2, -1, -1)
+        weight = weight.reshape(N * 2, 1, M)
+        x_padded = F.pad(x.reshape(1, bsz * 2, T), (pad_left, pad_right))
+        y = F.conv1d(x_padded, weight, groups=bsz * 2)  # [1, bsz*2*S*B, T]
+        y = y.view(bsz, 2, N // bsz, T).transpose(1, 2)
+        return y.reshape(N, 2, T)
+
+    def _filter_fft(self, x, h_bp_all, pad_right):
+        # Same output as the grouped convolution in _filter_raw, for long captures.
+        # Cross-correlating with h is convolving with h flipped, i.e. a product of
+        # spectra; the FFT length covers the full linear convolution so nothing wraps
+        # around. The taps are real, so I and Q are filtered together as I + jQ.
+        bsz, _, T = x.shape
+        N, M = h_bp_all.shape
+        n_fft = 1 << (T + M - 2).bit_length()  # power of two >= T + M - 1
+        X = torch.fft.fft(torch.complex(x[:, 0], x[:, 1]), n=n_fft)  # [bsz, n_fft]
+        H = torch.fft.fft(h_bp_all.flip(-1), n=n_fft)  # [bsz*S*B, n_fft]
+        y = torch.fft.ifft(X.unsqueeze(1) * H.view(bsz, N // bsz, n_fft))
+        y = y[..., pad_right : pad_right + T].reshape(N, T)
+        return torch.view_as_real(y).transpose(1, 2)  # [bsz*S*B, 2, T]
 
     def _downconvert_multiple(self, x_flat, freq_flat):
-        device = x_flat.device
-        dtype = x_flat.dtype
-        _, _, T = x_flat.shape
-        t = (
-            torch.arange(T, device=device, dtype=dtype).unsqueeze(0)
-            / SAMPLING_FREQUENCY
-        )
+        # One complex multiply by exp(-j*2*pi*f*t) instead of separate cos / sin
+        # tensors and four real multiplies. Expects float32 inputs (complex tensors
+        # have no bfloat16 variant).
         freq_flat = freq_flat.unsqueeze(-1)
-        angle = -2.0 * math.pi * freq_flat * t
-        shift_real = torch.cos(angle)
-        shift_imag = torch.sin(angle)
-        x_real = x_flat[:, 0, :]
-        x_imag = x_flat[:, 1, :]
-        y_real = x_real * shift_real - x_imag * shift_imag
-        y_imag = x_real * shift_imag + x_imag * shift_real
-        x_base = torch.stack([y_real, y_imag], dim=1)
+        angle = -2.0 * math.pi * freq_flat * self._t
+        shift = torch.polar(torch.ones_like(angle), angle)  # [N, T]
+        x_c = torch.view_as_complex(x_flat.transpose(1, 2).contiguous())  # [N, T]
+        x_base = torch.view_as_real(x_c * shift).transpose(1, 2)  # [N, 2, T]
         return x_base
 
 
 ###############################################################################
-# WidebandYoloLoss remains unchanged.
+# WidebandYoloLoss
 ###############################################################################
 class WidebandYoloLoss(nn.Module):
     def __init__(self):
@@ -355,20 +481,24 @@ class WidebandYoloLoss(nn.Module):
 
     def forward(self, pred, target):
         batch_size = pred.shape[0]
-        pred = pred.view(batch_size, pred.shape[1], B, (1 + 1 + NUM_CLASSES))
+        pred = pred.reshape(batch_size, pred.shape[1], B, (1 + 1 + NUM_CLASSES))
         x_pred = pred[..., 0]
         conf_pred = pred[..., 1]
         class_pred = pred[..., 2:]
         x_tgt = target[..., 0]
         conf_tgt = target[..., 1]
         class_tgt = target[..., 2:]
-        obj_mask = (conf_tgt > 0).float()
-        noobj_mask = 1.0 - obj_mask
-        coord_loss = LAMBDA_COORD * torch.sum(obj_mask * (x_pred - x_tgt) ** 2)
-        iou_1d = 1.0 - torch.abs(x_pred - x_tgt)
-        conf_loss_obj = torch.sum(obj_mask * (conf_pred - iou_1d) ** 2)
-        conf_loss_noobj = LAMBDA_NOOBJ * torch.sum(noobj_mask * (conf_pred**2))
-        class_diff = (class_pred - class_tgt) ** 2
-        class_loss = LAMBDA_CLASS * torch.sum(obj_mask.unsqueeze(-1) * class_diff)
-        total_loss = coord_loss + conf_loss_obj + conf_loss_noobj + class_loss
-        return total_loss / batch_size
+        obj_mask = conf_tgt > 0
+        x_diff = x_pred - x_tgt
+        iou_1d = 1.0 - torch.abs(x_diff)
+        # The differences are fresh tensors, so they are squared in place.
+        class_sq_err = (class_pred - class_tgt).pow_(2).sum(dim=-1)
+        conf_sq_err = (conf_pred - iou_1d).pow_(2)
+        # Per-box loss: the coordinate, confidence and class terms for boxes with an
+        # object, the no-object confidence term otherwise. Summed in one reduction.
+        box_loss = torch.where(
+            obj_mask,
+            LAMBDA_COORD * x_diff.square() + conf_sq_err + LAMBDA_CLASS * class_sq_err,
+            LAMBDA_NOOBJ * conf_pred.square(),
+        )
+        return box_loss.sum() / batch_size
@@ -0,0 +1,107 @@
+import copy
+import importlib
+import inspect
+import json
+import os
+import sys
+
+import pytest
+import torch
+from torch.utils.checkpoint import checkpoint
+
+# The BatchNorm buffers are only restored after the recomputation from PyTorch 2.1
+# (checkpoint's context_fn), older versions update them twice per step.
+pytestmark = pytest.mark.skipif(
+    "context_fn" not in inspect.signature(checkpoint).parameters,
+    reason="needs PyTorch >= 2.1",
+)
+
+YOLO_MODEL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="module")
+def model_module(tmp_path_factory):
+    # config_wideband_yolo reads the band margin from the first capture of the training
+    # set at import, so point it at a one-capture dataset.
+    root = tmp_path_factory.mktemp("wideband")
+    training = root / "dataset" / "training"
+    training.mkdir(parents=True)
+    meta = {
+        "annotations": [
+            {"sampling_rate": 1e6},
+            {"filter": {"sps": 8, "rolloff": 0.35}},
+        ]
+    }
+    (training / "capture-0.sigmf-meta").write_text(json.dumps(meta))
+    (root / "configs").mkdir()
+    (root / "configs" / "system_parameters.json").write_text(
+        json.dumps({"Dataset_Directory": str(root / "dataset")})
+    )
+
+    cwd = os.getcwd()
+    os.chdir(root)
+    sys.path.insert(0, YOLO_MODEL_DIR)
+    try:
+        yield importlib.import_module("model_and_loss_wideband_yolo")
+    finally:
+        sys.path.remove(YOLO_MODEL_DIR)
+        os.chdir(cwd)
+
+
+def _batchnorm_buffers(module):
+    return {
+        name: buf.clone()
+        for name, buf in module.named_buffers()
+        if name.split(".")[-1] in ("running_mean", "running_var", "num_batches_tracked")
+    }
+
+
+def _train_step(module, x, checkpointed, model_module):
+    if checkpointed:
+        out = model_module.checkpoint_block(module, x)
+    else:
+        out = module(x)
+    out.square().mean().backward()
+
+
+def test_checkpointing_updates_batchnorm_buffers_once(model_module):
+    torch.manual_seed(0)
+    block = model_module.ResidualBlock(32, 96).train()
+    block_ckpt = copy.deepcopy(block)
+    x = torch.randn(8, 32, 256)
+
+    _train_step(block, x.clone(), False, model_module)
+    _train_step(block_ckpt, x.clone().requires_grad_(), True, model_module)
+
+    buffers = _batchnorm_buffers(block)
+    buffers_ckpt = _batchnorm_buffers(block_ckpt)
+    assert buffers.keys() == buffers_ckpt.keys()
+    for name, buf in buffers.items():
+        assert torch.equal(buf, buffers_ckpt[name]), name
+    assert all(
+        buf.item() == 1 for name, buf in buffers.items() if "num_batches_tracked" in name
+    )
+
+    for p, p_ckpt in zip(block.parameters(), block_ckpt.parameters()):
+        torch.testing.assert_close(p.grad, p_ckpt.grad)
+
+    # The eval outputs therefore match too
+    block.eval()
+    block_ckpt.eval()
+    with torch.no_grad():
+        torch.testing.assert_close(block(x), block_ckpt(x))
+
+
+def test_compiled_checkpointing_updates_batchnorm_buffers_once(model_module):
+    torch.manual_seed(0)
+    block = model_module.ResidualBlock(32, 96).train()
+    block_ckpt = copy.deepcopy(block)
+    compiled = torch.compile(lambda x: model_module.checkpoint_block(block_ckpt, x))
+    x = torch.randn(4, 32, 64)
+
+    block(x).square().mean().backward()
+    compiled(x.clone().requires_grad_()).square().mean().backward()
+
+    buffers_ckpt = _batchnorm_buffers(block_ckpt)
+    for name, buf in _batchnorm_buffers(block).items():
+        torch.testing.assert_close(buf, buffers_ckpt[name], msg=name)
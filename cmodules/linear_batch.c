@@ -0,0 +1,49 @@
+// 
+// linear_batch.c
+//
+
+#include <stdlib.h>
+#include <stdio.h>
+
+#include "linear_batch.h"
+#include "linear_modulate.h"
+#include "rrc_tx.h"
+#include "channel.h"
+
+// Modulate, pulse shape and pass through the channel n_sig signals that share the symbol,
+// filter and channel parameters (the signals of one wideband capture) in a single call.
+// Signal k uses modtype[k], order[k] and seed[k], and its transmitted / received samples
+// are written to row k of xI, xQ, yI and yQ ([n_sig][n_out], n_out >= n_sym * sps).
+// s, smI and smQ are n_sym long scratch arrays for the symbols.
+void linear_modulate_batch(int n_sig, int modtype[], int order[], int seed[], int n_sym, int sps, unsigned int delay, float beta, float dt,
+                    int channel_type, float snr, float fo, float po, float k_factor, int num_taps, int awgn, float path_delays[], float path_gains[],
+                    unsigned int s[], float smI[], float smQ[], float xI[], float xQ[], float yI[], float yQ[], int n_out, int verbose)
+{
+    for (int k = 0; k < n_sig; k++)
+    {
+        float *xIk = &xI[k * n_out];
+        float *xQk = &xQ[k * n_out];
+        float *yIk = &yI[k * n_out];
+        float *yQk = &yQ[k * n_out];
+
+        linear_modulate(modtype[k], order[k], n_sym, s, smI, smQ, verbose, seed[k]);
+        rrc_tx(n_sym, sps, delay, beta, dt, smI, smQ, xIk, xQk, verbose);
+
+        switch (channel_type) {
+            case CHANNEL_AWGN:
+                channel(snr, n_sym, sps, fo, po, xIk, xQk, yIk, yQk, verbose, seed[k]);
+                break;
+            case CHANNEL_RAYLEIGH:
+                rayleigh_channel(snr, n_sym, sps, fo, po, num_taps, awgn, xIk, xQk, yIk, yQk,
+                                 path_delays, path_gains, verbose, seed[k]);
+                break;
+            case CHANNEL_RICIAN:
+                rician_channel(snr, n_sym, sps, fo, po, k_factor, num_taps, awgn, xIk, xQk, yIk, yQk,
+                               path_delays, path_gains, verbose, seed[k]);
+                break;
+            default:
+                printf("Invalid channel type.\n");
+                return;
+        }
+    }
+}
@@ -0,0 +1,16 @@
+// 
+// linear_batch.h
+//
+
+#ifndef LINEAR_BATCH_H
+#define LINEAR_BATCH_H
+
+#define CHANNEL_AWGN 0
+#define CHANNEL_RAYLEIGH 1
+#define CHANNEL_RICIAN 2
+
+void linear_modulate_batch(int n_sig, int modtype[], int order[], int seed[], int n_sym, int sps, unsigned int delay, float beta, float dt,
+                    int channel_type, float snr, float fo, float po, float k_factor, int num_taps, int awgn, float path_delays[], float path_gains[],
+                    unsigned int s[], float smI[], float smQ[], float xI[], float xQ[], float yI[], float yQ[], int n_out, int verbose);
+
+#endif
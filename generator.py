@@ -7,13 +7,24 @@ import json
 import numpy as np
 import os
 import ctypes
+import multiprocessing
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
 from utils import *
 
+try:
+    from numba import njit, prange
+except ImportError:  # numba is optional, the frequency shift falls back to numpy
+    njit = None
+
 CALCULATE_BER_SNR = False  # Flag to determine if we should calculate the BER to SNR values for BPSK modulation scheme.
 
 buf = 4096
 halfbuf = 2048
+OSC_BLOCK = 4096  # Samples per block of the oscillator recurrence, each block restarts from the exact phase.
 
 # Read the configs/system_parameters.json file.
 with open("./configs/system_parameters.json", mode="rt") as f:
@@ -23,66 +34,401 @@ with open("./configs/system_parameters.json", mode="rt") as f:
     dataset_directory = system_parameters["Dataset_Directory"]
 
 ## load c modules
-clinear = ctypes.CDLL(os.path.abspath("./cmodules/linear_modulate"))
-cam = ctypes.CDLL(os.path.abspath("./cmodules/am_modulate"))
-cfm = ctypes.CDLL(os.path.abspath("./cmodules/fm_modulate"))
-cfsk = ctypes.CDLL(os.path.abspath("./cmodules/fsk_modulate"))
-ctx = ctypes.CDLL(os.path.abspath("./cmodules/rrc_tx"))
-cchan = ctypes.CDLL(os.path.abspath("./cmodules/channel"))
+clinear_batch = ctypes.CDLL(os.path.abspath("./cmodules/linear_batch"))
+
+# Prototype of linear_modulate_batch, so ctypes converts the arguments without inspecting their types on every call
+c_int_p = ctypes.POINTER(ctypes.c_int)
+c_uint_p = ctypes.POINTER(ctypes.c_uint)
+c_float_p = ctypes.POINTER(ctypes.c_float)
+clinear_batch.linear_modulate_batch.argtypes = [
+    ctypes.c_int,  # n_sig
+    c_int_p,  # modtype
+    c_int_p,  # order
+    c_int_p,  # seed
+    ctypes.c_int,  # n_sym
+    ctypes.c_int,  # sps
+    ctypes.c_uint,  # delay
+    ctypes.c_float,  # beta
+    ctypes.c_float,  # dt
+    ctypes.c_int,  # channel_type
+    ctypes.c_float,  # snr
+    ctypes.c_float,  # fo
+    ctypes.c_float,  # po
+    ctypes.c_float,  # k_factor
+    ctypes.c_int,  # num_taps
+    ctypes.c_int,  # awgn
+    c_float_p,  # path_delays
+    c_float_p,  # path_gains
+    c_uint_p,  # s
+    c_float_p,  # smI
+    c_float_p,  # smQ
+    c_float_p,  # xI
+    c_float_p,  # xQ
+    c_float_p,  # yI
+    c_float_p,  # yQ
+    ctypes.c_int,  # n_out
+    ctypes.c_int,  # verbose
+]
+clinear_batch.linear_modulate_batch.restype = None
+
+# Channel type ids of linear_modulate_batch (cmodules/linear_batch.h)
+CHANNEL_TYPES = {"awgn": 0, "rayleigh": 1, "rician": 2}
+
+
+def calculate_ber_BPSK(tx_I, rx_I, sps):
+    # tx_I / rx_I are the trimmed (to match what is saved/used) float32 I samples.
+    # Demap the symbols to bits (BPSK decision on the real part).
+    tx_bits = tx_I[::sps] >= 0
+    rx_bits = rx_I[::sps] >= 0
 
+    # Sometimes the received bits are just inverted, so take the minimum of the errors
+    # against the bits and against the inverted bits (which is n_bits - errors).
+    bit_errors = np.count_nonzero(tx_bits != rx_bits)
+    bit_errors = min(bit_errors, tx_bits.size - bit_errors)
 
-def calculate_ber_BPSK(xI, yI, sps, trim):
-    # Convert inputs to numpy arrays
-    xI = np.array(xI)
-    yI = np.array(yI)
+    return bit_errors / tx_bits.size
 
-    # Trim the signals (to match what is saved/used)
-    tx_I = xI[trim:-trim]
-    rx_I = yI[trim:-trim]
 
-    tx_symbols = tx_I[::sps]
-    rx_symbols = rx_I[::sps]
+def _build_chan_args(channel_type, params):
+    # ctypes channel arguments of linear_modulate_batch for one capture:
+    # (channel type, snr, fo, po, k_factor, num_taps, awgn, path_delays, path_gains)
+    k_factor = 0.0
+    if channel_type == "awgn":
+        snr, fo, po = params
+        awgn_flag = 1
+        path_delays = path_gains = []
 
-    # Demap the symbols to bits (BPSK decision on the real part).
-    tx_bits = tx_symbols >= 0
-    rx_bits = rx_symbols >= 0
+    elif channel_type == "rayleigh":
+        snr, fo, po, awgn_flag, path_delays, path_gains = params
 
-    # Invert the bits to calculate the minimum - sometimes they are just inverted.
-    rx_bits_inversed = np.logical_not(rx_bits)
+    elif channel_type == "rician":
+        snr, fo, po, k_factor, awgn_flag, path_delays, path_gains = params
 
-    # # Calculate bit errors and BER.
-    bit_errors = min(np.sum(tx_bits != rx_bits), np.sum(tx_bits != rx_bits_inversed))
-    ber = bit_errors / len(tx_bits)
+    else:
+        raise ValueError("Undefined channel type.")
 
-    return ber
+    assert len(path_delays) == len(
+        path_gains
+    ), "Path delays and path gains must have the same length."
 
+    # Pass path_delays and path_gains as float32 arrays (the pointers keep the arrays alive)
+    path_delays_ptr, path_gains_ptr = (
+        np.ascontiguousarray(p, dtype=np.float32).ctypes.data_as(c_float_p)
+        for p in (path_delays, path_gains)
+    )
 
-def generate_linear(config, rng_seed):
-    rng_seed = int(rng_seed)
-    verbose = ctypes.c_int(config["verbose"])
-    n_samps = config["n_samps"] + buf
-    sampling_rate = config["sampling_rate"]
-
-    # Generate time vector for mixing
-    t = np.arange(n_samps - buf) / sampling_rate
-
-    sig_params = [
-        (_sps, _beta, _delay, _dt)
-        for _sps in config["symbol_rate"]
-        for _beta in config["rrc_filter"]["beta"]
-        for _delay in config["rrc_filter"]["delay"]
-        for _dt in config["rrc_filter"]["dt"]
-    ]
-    idx = np.random.choice(len(sig_params), config["n_captures"])
-    sig_params = [sig_params[_idx] for _idx in idx]
-    idx = np.random.choice(len(config["channel_params"]), config["n_captures"])
-    channel_params = [config["channel_params"][_idx] for _idx in idx]
-    channel_type = config["channel_type"]
+    return (
+        ctypes.c_int(CHANNEL_TYPES[channel_type]),
+        ctypes.c_float(snr),
+        ctypes.c_float(fo),
+        ctypes.c_float(po),
+        ctypes.c_float(k_factor),
+        ctypes.c_int(len(path_delays)),
+        ctypes.c_int(awgn_flag),
+        path_delays_ptr,
+        path_gains_ptr,
+    )
 
-    ber_dict = {}
 
-    for i in tqdm(range(0, config["n_captures"]), desc=f"Generating Data"):
+def mixing_tables(center_frequencies, t):
+    # float32 cos / sin of the frequency shift phase, one row per centre frequency
+    phase = 2 * np.pi * np.asarray(center_frequencies)[:, None] * t[None, :]
+    return np.cos(phase).astype(np.float32), np.sin(phase).astype(np.float32)
+
+
+def complex_mixing_table(center_frequencies, t):
+    # complex64 cos + j sin of the frequency shift phase (the mixing_tables rows), for the
+    # numpy frequency shift
+    cos_tbl, sin_tbl = mixing_tables(center_frequencies, t)
+    cs_tbl = np.empty(cos_tbl.shape, dtype=np.complex64)
+    cs_tbl.real = cos_tbl
+    cs_tbl.imag = sin_tbl
+    return cs_tbl
+
+
+if njit is not None:
+    # The kernels are compiled for explicit signatures, so they are compiled (or loaded
+    # from the on-disk cache) once at import instead of on their first call.
+    @njit(
+        "void(float32[::1], float32[::1], float32[::1], float32[::1], float32[::1], float32[::1])",
+        cache=True,
+        parallel=True,
+        fastmath=True,
+    )
+    def _mix_accum_jit(I, Q, c, s, I_total, Q_total):
+        # Fused frequency shift and accumulation, a single pass over the arrays
+        for n in prange(I.size):
+            i = I[n]
+            q = Q[n]
+            I_total[n] += i * c[n] - q * s[n]
+            Q_total[n] += i * s[n] + q * c[n]
+
+    @njit(
+        "void(float32[::1], float32[::1], float64, float32[::1], float32[::1])",
+        cache=True,
+        parallel=True,
+        fastmath=True,
+    )
+    def _mix_accum_osc_jit(I, Q, w, I_total, Q_total):
+        # Same as _mix_accum_jit for the phase w * n (w = 2 * pi * fc / fs), with the cos / sin
+        # generated by the oscillator recurrence (a rotation by w per sample) instead of read
+        # from tables. Each block starts from the exact phase, so the rounding error of the
+        # recurrence cannot build up, and the blocks run in parallel.
+        n_blocks = (I.size + OSC_BLOCK - 1) // OSC_BLOCK
+        cos_w = np.cos(w)
+        sin_w = np.sin(w)
+        for b in prange(n_blocks):
+            start = b * OSC_BLOCK
+            stop = min(start + OSC_BLOCK, I.size)
+            c = np.cos(w * start)
+            s = np.sin(w * start)
+            for n in range(start, stop):
+                i = I[n]
+                q = Q[n]
+                I_total[n] += i * c - q * s
+                Q_total[n] += i * s + q * c
+                c, s = c * cos_w - s * sin_w, s * cos_w + c * sin_w
+
+else:
+    _mix_accum_jit = None
+    _mix_accum_osc_jit = None
+
+
+def mix_accum(I, Q, cs, I_total, Q_total, iq):
+    # numpy frequency shift (used without numba): shift (I, Q) by the complex table row cs
+    # with a single complex64 multiply and add it to the wideband signal (I_total, Q_total).
+    # iq is complex64 scratch.
+    iq.real = I
+    iq.imag = Q
+    iq *= cs
+    I_total += iq.real
+    Q_total += iq.imag
+
+
+class CaptureGenerator:
+    """
+    Generates the wideband captures of a dataset one at a time. The ctypes return
+    buffers, their numpy views and the mixing tables are allocated once and reused by
+    every capture, so each process that generates captures has its own instance.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        # Config values read for every capture, bound once
+        self.channel_type = config["channel_type"]
+        self.modulation = config["modulation"]
+        self.sampling_rate = config["sampling_rate"]
+        self.center_frequencies_random = config["center_frequencies_random"]
+        self.verbose = config["verbose"]
+        self.n_samps = n_samps = config["n_samps"] + buf
+
+        # Generate time vector for mixing
+        self.t = np.arange(n_samps - buf) / config["sampling_rate"]
+
+        # Return arrays. The C modules fully overwrite them before reading, so they are left
+        # uninitialised (np.empty). The C modules write n_sym * sps >= n_samps samples, so
+        # they are sized for the largest n_sym and n_sym * sps over the configured samples
+        # per symbol. The sample arrays hold one row of n_out samples for each signal
+        # (centre frequency) of a capture.
         if config["center_frequencies_random"]:
+            max_n_sig = config["center_frequencies"][2]
+        else:
+            max_n_sig = len(config["center_frequencies"])
+        max_n_sym = max(int(np.ceil(n_samps / _sps)) for _sps in config["symbol_rate"])
+        self.n_out = max(
+            int(np.ceil(n_samps / _sps)) * _sps for _sps in config["symbol_rate"]
+        )
+        s = np.empty(max_n_sym, dtype=np.uint32)
+        smI = np.empty(max_n_sym, dtype=np.float32)
+        smQ = np.empty(max_n_sym, dtype=np.float32)
+        xI = np.empty((max_n_sig, self.n_out), dtype=np.float32)
+        xQ = np.empty((max_n_sig, self.n_out), dtype=np.float32)
+        yI = np.empty((max_n_sig, self.n_out), dtype=np.float32)
+        yQ = np.empty((max_n_sig, self.n_out), dtype=np.float32)
+        # Pointers passed to the C modules (they keep the arrays alive)
+        self.c_buffers = (
+            s.ctypes.data_as(c_uint_p),
+            *[arr.ctypes.data_as(c_float_p) for arr in (smI, smQ, xI, xQ, yI, yQ)],
+        )
+
+        # Views of the channel output (the part that is saved), one row per signal. They
+        # alias yI / yQ, so they are only used to accumulate into I_total / Q_total before
+        # the next capture overwrites the buffers.
+        self.I = yI[:, halfbuf : n_samps - halfbuf]
+        self.Q = yQ[:, halfbuf : n_samps - halfbuf]
+        # Transmitted I samples, for the BPSK BER
+        self.tx_I = xI[:, halfbuf : n_samps - halfbuf]
+
+        # Scratch array for the numpy frequency shift
+        self.iq = np.empty(n_samps - buf, dtype=np.complex64)
+
+        # Metadata fields that are the same for every capture
+        self.meta_tmpl = {
+            "n_samps": n_samps - buf,
+            "sampling_rate": config["sampling_rate"],
+            "channel_type": config["channel_type"],
+            "filter_type": "rrc",
+            "savepath": config["savepath"],
+            "savename": config["savename"],
+        }
+
+        # The mixing tables only depend on the centre frequencies, so unless these are
+        # drawn per capture they are computed once.
+        if not config["center_frequencies_random"]:
+            if _mix_accum_jit is not None:
+                self.cos_tbl, self.sin_tbl = mixing_tables(
+                    config["center_frequencies"], self.t
+                )
+            else:
+                self.cs_tbl = complex_mixing_table(config["center_frequencies"], self.t)
+
+    def modulate(self, mods, seeds, sps, delay, beta, dt, chan_args):
+        # Modulate, pulse shape and pass the signals (one per modulation / C seed) through the
+        # channel in one C call. Returns the [signal, saved sample] views of the received
+        # I / Q and of the transmitted I samples, valid until the next call.
+        n_sig = len(mods)
+
+        # Adjust n_sym for chunk processing
+        n_sym = int(np.ceil(self.n_samps / sps.value))  # Ensure the right number of symbols
+
+        clinear_batch.linear_modulate_batch(
+            n_sig,
+            (ctypes.c_int * n_sig)(*[mod[0] for mod in mods]),
+            (ctypes.c_int * n_sig)(*[mod[1] for mod in mods]),
+            (ctypes.c_int * n_sig)(*seeds),
+            n_sym,
+            sps,
+            delay,
+            beta,
+            dt,
+            *chan_args,
+            *self.c_buffers,
+            self.n_out,
+            self.verbose,
+        )
+        return self.I[:n_sig], self.Q[:n_sig], self.tx_I[:n_sig]
+
+    def mix(self, I, Q, center_frequencies):
+        # Frequency shift each signal (row of I / Q) to its centre frequency and sum them to
+        # create the wideband signal.
+        I_total = np.zeros(self.n_samps - buf, dtype=np.float32)
+        Q_total = np.zeros(self.n_samps - buf, dtype=np.float32)
+
+        # Centre frequencies drawn per capture are mixed with the oscillator recurrence
+        # (if numba is available) rather than building tables that are used once.
+        if self.center_frequencies_random and _mix_accum_osc_jit is not None:
+            sampling_rate = self.sampling_rate
+            for k, center_freq in enumerate(center_frequencies):
+                w = 2 * np.pi * center_freq / sampling_rate
+                _mix_accum_osc_jit(I[k], Q[k], w, I_total, Q_total)
+            return I_total, Q_total
+
+        # Fixed centre frequencies are mixed with the tables computed once
+        if _mix_accum_jit is not None:
+            for k in range(len(center_frequencies)):
+                _mix_accum_jit(
+                    I[k], Q[k], self.cos_tbl[k], self.sin_tbl[k], I_total, Q_total
+                )
+            return I_total, Q_total
+
+        # Without numba, numpy mixing with complex tables
+        if self.center_frequencies_random:
+            cs_tbl = complex_mixing_table(center_frequencies, self.t)
+        else:
+            cs_tbl = self.cs_tbl
+        for k in range(len(center_frequencies)):
+            mix_accum(I[k], Q[k], cs_tbl[k], I_total, Q_total, self.iq)
+        return I_total, Q_total
+
+    def generate(self, task):
+        # Generate the capture described by a task from draw_capture_tasks. Returns the
+        # wideband I / Q samples, the metadata and the (snr, ber) of its BPSK signals
+        # (only collected if CALCULATE_BER_SNR).
+        sig_params, channel_params, center_frequencies, mod_indices, seeds = task
+
+        # The channel and signal parameters are the same for every centre frequency of a capture
+        chan_args = _build_chan_args(self.channel_type, channel_params)
+        snr, fo, po = chan_args[1:4]
+        sps = ctypes.c_int(sig_params[0])
+        beta = ctypes.c_float(sig_params[1])
+        delay = ctypes.c_uint(int(sig_params[2]))
+        dt = ctypes.c_float(sig_params[3])
+
+        modulation = self.modulation
+        mods = [modulation[index] for index in mod_indices]
+        mod_list = [mod[-1] for mod in mods]
+
+        I, Q, tx_I = self.modulate(mods, seeds, sps, delay, beta, dt, chan_args)
+
+        bers = []
+        if CALCULATE_BER_SNR:
+            for k in range(len(mods)):
+                if mod_list[k] == "bpsk":
+                    ber = calculate_ber_BPSK(tx_I[k], I[k], sps.value)
+                    bers.append((snr.value, ber))
+
+        I_total, Q_total = self.mix(I, Q, center_frequencies)
+
+        # Metadata
+        metadata = self.meta_tmpl.copy()
+        metadata.update(
+            modname=mod_list,
+            order=mods[-1][1],
+            center_frequencies=center_frequencies,
+            snr=snr.value,
+            sps=sps.value,
+            fo=fo.value,
+            po=po.value,
+            delay=delay.value,
+            beta=beta.value,
+            dt=dt.value,
+        )
+
+        return I_total, Q_total, metadata, bers
+
+
+def draw_capture_tasks(config, rng_seed):
+    # Yield the random parameters of every capture: (signal parameters, channel
+    # parameters, centre frequencies, modulation index and C seed per centre frequency).
+    # All the random draws happen here, in the parent process and in capture order, so
+    # the dataset does not depend on how many processes generate it.
+    #
+    # Seeding: capture i gets its own child of SeedSequence(rng_seed), and each of its
+    # signals is seeded with a word of that child's state (masked to a non-negative C int,
+    # a negative seed makes the C modules seed from the time). The seeds are therefore
+    # distinct, reproducible for a given rng_seed, and independent of the capture order.
+    # With CALCULATE_BER_SNR every signal uses rng_seed, so the BER is measured on the same bits.
+    rng_seed = int(rng_seed)
+    # Config values read for every capture, bound once
+    n_captures = config["n_captures"]
+    channel_params = config["channel_params"]
+    n_mods = len(config["modulation"])
+    center_frequencies_random = config["center_frequencies_random"]
+    capture_seeds = np.random.SeedSequence(rng_seed).spawn(n_captures)
+
+    # All the combinations of the signal parameters, one flat array per parameter (in the
+    # order sps, beta, delay, dt with dt varying fastest), indexed by the same choice.
+    sps_all, beta_all, delay_all, dt_all = (
+        grid.ravel()
+        for grid in np.meshgrid(
+            config["symbol_rate"],
+            config["rrc_filter"]["beta"],
+            config["rrc_filter"]["delay"],
+            config["rrc_filter"]["dt"],
+            indexing="ij",
+        )
+    )
+    idx = np.random.choice(sps_all.size, n_captures)
+    sps_sel = sps_all[idx].astype(int).tolist()
+    beta_sel = beta_all[idx].tolist()
+    delay_sel = delay_all[idx].astype(int).tolist()
+    dt_sel = dt_all[idx].tolist()
+    # The channel parameter rows have different lengths per channel type, so the rows
+    # are looked up by index per capture.
+    chan_idx = np.random.choice(len(channel_params), n_captures)
+
+    for i in range(0, n_captures):
+        if center_frequencies_random:
             lower_bound, upper_bound, n_max = config["center_frequencies"]
             n = np.random.randint(1, n_max + 1)
             center_frequencies = np.random.uniform(lower_bound, upper_bound, n)
@@ -91,192 +437,121 @@ def generate_linear(config, rng_seed):
         else:
             center_frequencies = config["center_frequencies"]
 
-        mod_list = []
-
-        I_total = np.zeros(n_samps - buf, dtype=np.float32)
-        Q_total = np.zeros(n_samps - buf, dtype=np.float32)
+        if CALCULATE_BER_SNR:
+            seeds = [rng_seed] * len(center_frequencies)
+        else:
+            seeds = capture_seeds[i].generate_state(
+                len(center_frequencies), dtype=np.uint32
+            )
+            seeds = (seeds & 0x7FFFFFFF).tolist()
 
-        for center_freq in center_frequencies:
-            if not CALCULATE_BER_SNR:
-                rng_seed += 1
-            seed = ctypes.c_int(rng_seed)
+        mod_indices = []
+        for _ in center_frequencies:
             # Choose a random element from the modulation list
-            if len(config["modulation"]) == 1:
-                index = 0
+            if n_mods == 1:
+                mod_indices.append(0)
             else:
-                index = np.random.randint(0, len(config["modulation"]))
-            mod = config["modulation"][index]
-            modtype = ctypes.c_int(mod[0])
-            mod_list.append(mod[-1])
-
-            # Extract channel parameters based on type
-            if channel_type == "awgn":
-                snr, fo, po = channel_params[i]
-                snr = ctypes.c_float(snr)
-                fo = ctypes.c_float(fo)
-                po = ctypes.c_float(po)
-
-            elif channel_type == "rayleigh":
-                (
-                    snr,
-                    fo,
-                    po,
-                    awgn_flag,
-                    path_delays,
-                    path_gains,
-                ) = channel_params[i]
-
-                assert len(path_delays) == len(
-                    path_gains
-                ), "Path delays and path gains must have the same length."
-                snr = ctypes.c_float(snr)
-                fo = ctypes.c_float(fo)
-                po = ctypes.c_float(po)
-                num_taps = ctypes.c_int(len(path_delays))
-                awgn = ctypes.c_int(awgn_flag)
-
-                # Convert path_delays and path_gains to ctypes arrays
-                path_delays_ctypes = (ctypes.c_float * len(path_delays))(*path_delays)
-                path_gains_ctypes = (ctypes.c_float * len(path_gains))(*path_gains)
-
-            elif channel_type == "rician":
-                (
-                    snr,
-                    fo,
-                    po,
-                    k_factor,
-                    awgn_flag,
-                    path_delays,
-                    path_gains,
-                ) = channel_params[i]
-                assert len(path_delays) == len(
-                    path_gains
-                ), "Path delays and path gains must have the same length."
-                snr = ctypes.c_float(snr)
-                fo = ctypes.c_float(fo)
-                po = ctypes.c_float(po)
-                k_factor = ctypes.c_float(k_factor)
-                num_taps = ctypes.c_int(len(path_delays))
-                awgn = ctypes.c_int(awgn_flag)
-
-                # Convert path_delays and path_gains to ctypes arrays
-                path_delays_ctypes = (ctypes.c_float * len(path_delays))(*path_delays)
-                path_gains_ctypes = (ctypes.c_float * len(path_gains))(*path_gains)
+                mod_indices.append(np.random.randint(0, n_mods))
+
+        yield (
+            (sps_sel[i], beta_sel[i], delay_sel[i], dt_sel[i]),
+            channel_params[chan_idx[i]],
+            center_frequencies,
+            mod_indices,
+            seeds,
+        )
+
+
+# CaptureGenerator of a worker process, created by _init_worker
+_capture_generator = None
+
+
+def _init_worker(config):
+    global _capture_generator
+    _capture_generator = CaptureGenerator(config)
+
+
+def _generate_capture(task):
+    return _capture_generator.generate(task)
+
+
+def _map_captures(config, tasks, n_workers):
+    # Generate the captures in order, in n_workers processes (or in this one if n_workers
+    # is 1). At most 2 * n_workers captures are in flight, so finished captures waiting
+    # to be saved do not pile up in memory. The workers are spawned rather than forked,
+    # the Numba threading layer started by compiling the kernels at import is not fork-safe
+    # (each spawned worker loads the compiled kernels from the on-disk cache).
+    if n_workers <= 1:
+        _init_worker(config)
+        yield from map(_generate_capture, tasks)
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=n_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(config,),
+    ) as executor:
+        pending = deque()
+        for task in tasks:
+            pending.append(executor.submit(_generate_capture, task))
+            if len(pending) >= 2 * n_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _writer_loop(save_queue, errors):
+    # Save the (I, Q, metadata, index) captures put on save_queue until None is put. After
+    # a failed save the remaining captures are only drained, so the producer never blocks.
+    while True:
+        item = save_queue.get()
+        if item is None:
+            return
+        if errors:
+            continue
+        try:
+            save_sigmf(*item)
+        except Exception as e:
+            errors.append(e)
+
+
+def generate_linear(config, rng_seed, n_workers=1):
+    tasks = draw_capture_tasks(config, rng_seed)
 
-            else:
-                raise ValueError("Undefined channel type.")
-
-            order = ctypes.c_int(mod[1])
-            sps = ctypes.c_int(sig_params[i][0])
-            beta = ctypes.c_float(sig_params[i][1])
-            delay = ctypes.c_uint(int(sig_params[i][2]))
-            dt = ctypes.c_float(sig_params[i][3])
-
-            # Adjust n_sym for chunk processing
-            n_sym = int(
-                np.ceil(n_samps / sps.value)
-            )  # Ensure the right number of symbols
-
-            # Create return arrays
-            s = (ctypes.c_uint * n_sym)(*np.zeros(n_sym, dtype=int))
-            smI = (ctypes.c_float * n_sym)(*np.zeros(n_sym))
-            smQ = (ctypes.c_float * n_sym)(*np.zeros(n_sym))
-            xI = (ctypes.c_float * n_samps)(*np.zeros(n_samps))
-            xQ = (ctypes.c_float * n_samps)(*np.zeros(n_samps))
-            yI = (ctypes.c_float * n_samps)(*np.zeros(n_samps))
-            yQ = (ctypes.c_float * n_samps)(*np.zeros(n_samps))
-
-            # Call C modules for chunk processing
-            clinear.linear_modulate(
-                modtype, order, ctypes.c_int(n_sym), s, smI, smQ, verbose, seed
-            )
-            ctx.rrc_tx(
-                ctypes.c_int(n_sym), sps, delay, beta, dt, smI, smQ, xI, xQ, verbose
-            )
-
-            # Channel Type
-            if channel_type == "awgn":
-                cchan.channel(snr, n_sym, sps, fo, po, xI, xQ, yI, yQ, verbose, seed)
-            elif channel_type == "rayleigh":
-                cchan.rayleigh_channel(
-                    snr,
-                    n_sym,
-                    sps,
-                    fo,
-                    po,
-                    num_taps,
-                    awgn,
-                    xI,
-                    xQ,
-                    yI,
-                    yQ,
-                    path_delays_ctypes,
-                    path_gains_ctypes,
-                    verbose,
-                    seed,
-                )
-            elif channel_type == "rician":
-                cchan.rician_channel(
-                    snr,
-                    n_sym,
-                    sps,
-                    fo,
-                    po,
-                    k_factor,
-                    num_taps,
-                    awgn,
-                    xI,
-                    xQ,
-                    yI,
-                    yQ,
-                    path_delays_ctypes,
-                    path_gains_ctypes,
-                    verbose,
-                    seed,
-                )
+    ber_dict = {}
 
-            if (mod[-1] == "bpsk") and (CALCULATE_BER_SNR):
-                ber = calculate_ber_BPSK(xI, yI, sps.value, trim=halfbuf)
-                if snr.value not in ber_dict:
-                    ber_dict[snr.value] = [ber]
+    # The captures are saved by a writer thread, so the next capture is generated while
+    # the previous one is written. Every capture has its own I_total / Q_total arrays, so
+    # they are queued without a copy. The queue is bounded to keep memory in check.
+    save_queue = queue.Queue(maxsize=4)
+    save_errors = []
+    writer = threading.Thread(target=_writer_loop, args=(save_queue, save_errors))
+    writer.start()
+
+    try:
+        for i, (I_total, Q_total, metadata, bers) in enumerate(
+            tqdm(
+                _map_captures(config, tasks, n_workers),
+                total=config["n_captures"],
+                desc=f"Generating Data",
+            )
+        ):
+            for snr, ber in bers:
+                if snr not in ber_dict:
+                    ber_dict[snr] = [ber]
                 else:
-                    ber_dict[snr.value].append(ber)
-
-            I = np.array(yI)[halfbuf:-halfbuf]
-            Q = np.array(yQ)[halfbuf:-halfbuf]
-
-            # Apply frequency shift for wideband signal
-            freq_shift = np.exp(1j * 2 * np.pi * center_freq * t)
-
-            I_shifted = I * np.real(freq_shift) - Q * np.imag(freq_shift)
-            Q_shifted = I * np.imag(freq_shift) + Q * np.real(freq_shift)
-
-            # Sum to create the wideband signal
-            I_total += I_shifted
-            Q_total += Q_shifted
-
-        # Metadata
-        metadata = {
-            "modname": mod_list,
-            "order": order.value,
-            "n_samps": n_samps - buf,
-            "sampling_rate": config["sampling_rate"],
-            "center_frequencies": center_frequencies,
-            "channel_type": config["channel_type"],
-            "snr": snr.value,
-            "filter_type": "rrc",
-            "sps": sps.value,
-            "fo": fo.value,
-            "po": po.value,
-            "delay": delay.value,
-            "beta": beta.value,
-            "dt": dt.value,
-            "savepath": config["savepath"],
-            "savename": config["savename"],
-        }
-
-        # Save the concatenated data for this capture in SigMF format
-        save_sigmf(I_total, Q_total, metadata, i)
+                    ber_dict[snr].append(ber)
+
+            if save_errors:
+                break
+            # Save the concatenated data for this capture in SigMF format
+            save_queue.put((I_total, Q_total, metadata, i))
+    finally:
+        save_queue.put(None)
+        writer.join()
+    if save_errors:
+        raise save_errors[0]
 
     if CALCULATE_BER_SNR:
         # After processing all captures, calculate and print the average BER per SNR.
@@ -307,6 +582,12 @@ if __name__ == "__main__":
         nargs="?",
         help="Random seed for data generation.",
     )
+    parser.add_argument(
+        "--n_workers",
+        type=int,
+        default=1,
+        help="Number of processes generating captures in parallel.",
+    )
     args = parser.parse_args()
 
     with open(args.config_file) as f:
@@ -325,7 +606,7 @@ if __name__ == "__main__":
     config = map_config(config, defaults, dataset_directory)
 
     ## Generate the data
-    generate_linear(config, rng_seed=rng_seed)
+    generate_linear(config, rng_seed=rng_seed, n_workers=args.n_workers)
 
     if config["archive"]:
         archive_sigmf(config["savepath"])